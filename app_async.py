@@ -0,0 +1,61 @@
+#!/usr/bin/env python
+#-*- coding: utf-8 -*-
+'''
+app_async
+~~~~~~~~~
+
+Launches the application on a gevent event loop.  The standard library and
+psycopg2 are patched to yield to the loop while they wait on sockets and on
+Postgres, so one process serves many slow requests at once.  Requires the
+gevent and psycogreen packages.
+
+    python app_async.py
+
+Copyright 2015 RPS ASA
+See LICENSE.txt
+'''
+
+def patch():
+    '''
+    Makes the standard library and psycopg2 cooperative.  Must be called
+    before cbibs_api is imported.
+    '''
+    try:
+        from gevent import monkey
+        from psycogreen.gevent import patch_psycopg
+    except ImportError:
+        raise RuntimeError('The gevent and psycogreen packages are required '
+                           'to serve the application asynchronously')
+    monkey.patch_all()
+    patch_psycopg()
+
+def configure_pool(app):
+    '''
+    Sizes the database pool with the ASYNC_SQLALCHEMY_POOL_SIZE,
+    ASYNC_SQLALCHEMY_MAX_OVERFLOW and ASYNC_SQLALCHEMY_POOL_TIMEOUT settings.
+    Must be called before the first query creates the engine.
+    '''
+    for name in ('POOL_SIZE', 'MAX_OVERFLOW', 'POOL_TIMEOUT'):
+        if 'ASYNC_SQLALCHEMY_' + name in app.config:
+            app.config['SQLALCHEMY_' + name] = app.config['ASYNC_SQLALCHEMY_' + name]
+
+def create_server(host, port, concurrency):
+    '''
+    Returns a gevent WSGI server for the application handling at most
+    concurrency requests at once
+    '''
+    from gevent.pool import Pool
+    from gevent.pywsgi import WSGIServer
+    from cbibs_api import app
+    # registers the RPC endpoint
+    from cbibs_api.api import api
+    return WSGIServer((host, port), app, spawn=Pool(concurrency))
+
+if __name__ == '__main__':
+    patch()
+    from cbibs_api import app
+    configure_pool(app)
+    server = create_server(app.config['HOST'],
+                           app.config.get('ASYNC_PORT', app.config['PORT']),
+                           app.config.get('ASYNC_CONCURRENCY', 100))
+    server.serve_forever()
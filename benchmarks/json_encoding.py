@@ -0,0 +1,63 @@
+#!/usr/bin/env python
+'''
+benchmarks/json_encoding.py
+
+Compares encoding a 100k point QueryData result the way output_json did,
+from lists built with tolist() and per row strftime, with the serializers in
+cbibs_api.serializers encoding the NumPy columns directly.
+
+    python benchmarks/json_encoding.py [points]
+'''
+
+from cbibs_api.serializers import create_serializer
+from timeit import timeit
+import json
+import sys
+import numpy as np
+import pandas as pd
+
+def main(points=100000, repeat=5):
+    table = pd.DataFrame({
+        'measure_ts': pd.date_range('2015-01-01', periods=points, freq='6min'),
+        'obs_value': np.random.uniform(0, 30, points)
+    })
+
+    def lists():
+        result = {
+            'measurement': 'sea_water_temperature',
+            'units': 'C',
+            'values': {
+                'time': [t.strftime('%Y-%m-%d %H:%M:%S') for t in table['measure_ts']],
+                'value': table['obs_value'].values.tolist()
+            }
+        }
+        return json.dumps({'id': 1, 'result': result, 'error': None})
+
+    def arrays(dumps):
+        result = {
+            'measurement': 'sea_water_temperature',
+            'units': 'C',
+            'values': {
+                'time': table['measure_ts'].values,
+                'value': table['obs_value'].values
+            }
+        }
+        return dumps({'id': 1, 'result': result, 'error': None})
+
+    print '%d points, best of %d' % (points, repeat)
+    baseline = min(timeit(lists, number=1) for i in range(repeat))
+    print '%-24s %8.1f ms' % ('json.dumps of lists', baseline * 1000)
+    for backend in ('json', 'simplejson', 'ujson'):
+        try:
+            dumps = create_serializer(backend)
+        except RuntimeError as e:
+            print '%-24s %s' % (backend, e)
+            continue
+        if backend == 'json':
+            assert arrays(dumps) == lists()
+        elapsed = min(timeit(lambda: arrays(dumps), number=1) for i in range(repeat))
+        print '%-24s %8.1f ms  %.1fx' % (backend + ' of arrays', elapsed * 1000,
+                                          baseline / elapsed)
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:2]])
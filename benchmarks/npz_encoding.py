@@ -0,0 +1,52 @@
+#!/usr/bin/env python
+'''
+benchmarks/npz_encoding.py
+
+Compares the size and the client side parse time of a 100k point QueryData
+result sent as JSON with the same result sent as application/x-npz.
+
+    python benchmarks/npz_encoding.py [points]
+'''
+
+from cbibs_api import app
+from cbibs_api.utils import output_json, output_npz, ColumnarResult
+from collections import OrderedDict
+from io import BytesIO
+from timeit import timeit
+import json
+import sys
+import numpy as np
+import pandas as pd
+
+def main(points=100000, repeat=5):
+    times = pd.date_range('2015-01-01', periods=points, freq='6min').values
+    values = np.random.uniform(0, 30, points)
+    members = OrderedDict([('measurement', 'sea_water_temperature'),
+                           ('report_name', 'Water Temperature'),
+                           ('units', 'C')])
+    result = dict(members, values={'time': times, 'value': values})
+    columns = ColumnarResult(members, OrderedDict([
+        ('time', times.astype('datetime64[s]')), ('value', values)]))
+
+    with app.test_request_context():
+        encoded_json = output_json(result, 200).get_data()
+        encoded_npz = output_npz(columns, 200).get_data()
+
+    def parse_json():
+        values = json.loads(encoded_json)['result']['values']
+        return pd.to_datetime(values['time']), np.array(values['value'])
+
+    def parse_npz():
+        arrays = np.load(BytesIO(encoded_npz))
+        return arrays['time'], arrays['value']
+
+    print '%d points, best of %d' % (points, repeat)
+    baseline = min(timeit(parse_json, number=1) for i in range(repeat))
+    elapsed = min(timeit(parse_npz, number=1) for i in range(repeat))
+    print '%-8s %10d bytes %8.1f ms parse' % ('json', len(encoded_json), baseline * 1000)
+    print '%-8s %10d bytes %8.1f ms parse  %.1fx smaller, %.1fx faster' % (
+        'npz', len(encoded_npz), elapsed * 1000,
+        float(len(encoded_json)) / len(encoded_npz), baseline / elapsed)
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:2]])
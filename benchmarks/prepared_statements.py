@@ -0,0 +1,59 @@
+#!/usr/bin/env python
+'''
+benchmarks/prepared_statements.py
+
+Compares running the join heavy stored queries as plain text, planned on
+every call, with running them as prepared statements.  Reports the planning
+time from EXPLAIN ANALYZE and the mean time of a call each way.  Needs the
+database configured for the application.
+
+    python benchmarks/prepared_statements.py [calls]
+'''
+
+from cbibs_api import app, db
+from cbibs_api.plans import SAMPLE_PARAMS
+from cbibs_api.queries import SQL
+import json
+import sys
+import time
+
+QUERIES = ('GetNumberMeasurements', 'LastMeasurementTime', 'QueryDataRaw',
+           'GetMetaDataLocation', 'ListStationsWithParam',
+           'RetrieveCurrentReadings', 'RetrieveCurrentSuperSet')
+
+def planning_time(connection, sql):
+    result = connection.execute('EXPLAIN (ANALYZE, FORMAT JSON) ' + sql,
+                                SAMPLE_PARAMS).scalar()
+    if isinstance(result, basestring):
+        result = json.loads(result)
+    return result[0]['Planning Time']
+
+def mean_time(connection, sql, calls):
+    start = time.time()
+    for i in range(calls):
+        connection.execute(sql, SAMPLE_PARAMS).fetchall()
+    return (time.time() - start) / calls * 1000
+
+def main(calls=50):
+    # the statements are prepared explicitly below
+    app.config['PREPARED_STATEMENTS'] = False
+    print '%-26s %12s %12s %12s %12s' % ('query', 'plan ms', 'plan ms',
+                                         'call ms', 'call ms')
+    print '%-26s %12s %12s %12s %12s' % ('', 'text', 'prepared',
+                                         'text', 'prepared')
+    with db.engine.connect() as connection:
+        for name in QUERIES:
+            stored = SQL[name]
+            connection.execute(stored.prepare_sql)
+            text_call = mean_time(connection, stored, calls)
+            # after five executions the server may switch to a generic plan
+            prepared_call = mean_time(connection, stored.execute_sql, calls)
+            print '%-26s %12.3f %12.3f %12.3f %12.3f' % (
+                name,
+                planning_time(connection, stored),
+                planning_time(connection, stored.execute_sql),
+                text_call, prepared_call)
+            connection.execute('DEALLOCATE %s' % stored.prepared_name)
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:2]])
@@ -0,0 +1,32 @@
+#!/usr/bin/env python
+'''
+benchmarks/time_formatting.py
+
+Compares formatting the measure_ts column of a 100k point series with a
+strftime per value, as the time series methods did, with format_times.
+
+    python benchmarks/time_formatting.py [points]
+'''
+
+from cbibs_api.serializers import format_times
+from timeit import timeit
+import sys
+import pandas as pd
+
+def main(points=100000, repeat=5):
+    column = pd.Series(pd.date_range('2015-01-01', periods=points, freq='6min'))
+
+    def strftime():
+        return [t.strftime('%Y-%m-%d %H:%M:%S') for t in column]
+
+    assert format_times(column) == strftime()
+    print '%d timestamps, best of %d' % (points, repeat)
+    baseline = min(timeit(strftime, number=1) for i in range(repeat))
+    print '%-16s %8.1f ms' % ('strftime', baseline * 1000)
+    elapsed = min(timeit(lambda: format_times(column), number=1)
+                  for i in range(repeat))
+    print '%-16s %8.1f ms  %.1fx' % ('format_times', elapsed * 1000,
+                                      baseline / elapsed)
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:2]])
@@ -0,0 +1,39 @@
+#!/usr/bin/env python
+'''
+benchmarks/xml_encoding.py
+
+Compares encoding a 100k point QueryDataSimple result with xmlrpclib, as
+output_xml did, with the array aware encoder it now uses.
+
+    python benchmarks/xml_encoding.py [points]
+'''
+
+from cbibs_api.utils import xml_response
+from datetime import datetime, timedelta
+from defusedxml.xmlrpc import xmlrpc_client
+from timeit import timeit
+import random
+import sys
+
+def main(points=100000, repeat=5):
+    start = datetime(2015, 1, 1)
+    result = {
+        'time': [(start + timedelta(minutes=6 * i)).strftime('%Y-%m-%d %H:%M:%S')
+                 for i in range(points)],
+        'value': [random.uniform(0, 30) for i in range(points)]
+    }
+
+    def dumps():
+        return xmlrpc_client.dumps((result,), methodresponse=True)
+
+    assert xml_response(result) == dumps()
+    print '%d points, best of %d' % (points, repeat)
+    baseline = min(timeit(dumps, number=1) for i in range(repeat))
+    print '%-16s %8.1f ms' % ('xmlrpclib', baseline * 1000)
+    elapsed = min(timeit(lambda: xml_response(result), number=1)
+                  for i in range(repeat))
+    print '%-16s %8.1f ms  %.1fx' % ('xml_response', elapsed * 1000,
+                                      baseline / elapsed)
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:2]])
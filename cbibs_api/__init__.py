@@ -14,6 +14,8 @@ from flask_environments import Environments
 from flask.ext.sqlalchemy import SQLAlchemy
 from flask_restful import Api
 from cbibs_api.reverse_proxy import ReverseProxied
+from cbibs_api.pool import InstrumentedQueuePool, ping_connection
+from sqlalchemy import event
 import os
 
 app = Flask(__name__)
@@ -45,5 +47,26 @@ if app.config['LOGGING'] == True:
     app.logger.setLevel(logging.DEBUG)
     app.logger.info('Application Process Started')
 
+class PooledSQLAlchemy(SQLAlchemy):
+    """
+    Creates PostgreSQL engines with an InstrumentedQueuePool and the
+    STATEMENT_TIMEOUT (milliseconds) applied to every connection.  Pool sizing
+    is read by Flask-SQLAlchemy from the SQLALCHEMY_POOL_* settings.
+    """
+    def apply_driver_hacks(self, app, info, options):
+        SQLAlchemy.apply_driver_hacks(self, app, info, options)
+        if info.drivername.startswith('postgres'):
+            options['poolclass'] = InstrumentedQueuePool
+            if app.config.get('STATEMENT_TIMEOUT'):
+                options['connect_args'] = {
+                    'options': '-c statement_timeout=%d' % app.config['STATEMENT_TIMEOUT']
+                }
+
 api = Api(app)
-db = SQLAlchemy(app)
+db = PooledSQLAlchemy(app)
+
+if app.config.get('POOL_PRE_PING'):
+    event.listen(InstrumentedQueuePool, 'checkout', ping_connection)
+
+# register the routes defined outside of the RPC endpoint
+import cbibs_api.controller
@@ -10,34 +10,243 @@ Copyright 2015 RPS ASA
 See LICENSE.txt
 '''
 
-from flask import request, Response, jsonify
+from flask import request, Response, jsonify, make_response
 from flask_restful import Resource
 from cbibs_api import app, api, db
 from cbibs_api.utils import check_api_key_and_req_type, UnauthorizedError, request_wants_xml, request_wants_json
-from cbibs_api.utils import output_json, output_xml
+from cbibs_api.utils import output_json, output_xml, stream_json, stream_xml
+from cbibs_api.utils import output_npz, ColumnarResult, NPZ_MEDIATYPE, BINARY_MEDIATYPES
+from cbibs_api.utils import json_dumps
+from cbibs_api.utils import stream_query, StreamedColumns, StreamedText
 from cbibs_api.queries import SQL
-from defusedxml.xmlrpc import xmlrpc_client
+from cbibs_api.rpc import RpcCall, decode_call, is_xml
+from cbibs_api.registry import register, methods, BOTH_NAMESPACES
+from cbibs_api.series import resolve_series, query_series, stream_series
+from cbibs_api.series import resolve_many, query_many
+from cbibs_api.series import series_columns, SERIES_COLUMNS
+from cbibs_api.series import encode_cursor, decode_since
+from cbibs_api.serializers import format_times
+from cbibs_api.cache import TTLCache, MISSING, ResponseCache, create_backend
+from cbibs_api.compression import compress_response, negotiate_encoding
+from cbibs_api.compression import encode_variants, pack_variants, unpack_variants
 from collections import OrderedDict
 from werkzeug.wrappers import Response as ResponseBase
+from werkzeug.exceptions import BadRequest, MethodNotAllowed
 from flask_restful.utils import error_data, unpack
 from jinja2 import Environment, PackageLoader
-from copy import copy
 from dateutil.relativedelta import relativedelta
 from dateutil.parser import parse as dateparse
 from datetime import datetime
+from calendar import timegm
+from itertools import chain, izip
+from multiprocessing.pool import ThreadPool
+from threading import Lock
+import hashlib
+import json
+import time
+import numpy as np
 import pandas as pd
 
 # Is this superfluous because of flask?
 j2 = Environment(loader=PackageLoader('cbibs_api', 'templates'))
 
+# catalog query results, flushed through /admin/flush_cache
+catalog_cache = TTLCache(app.config.get('CATALOG_CACHE_SIZE', 512))
+
+# encoded RPC responses, shared between the worker processes of a host
+response_cache = ResponseCache(create_backend(
+    app.config.get('RESPONSE_CACHE_BACKEND', 'local'),
+    path=app.config.get('RESPONSE_CACHE_PATH'),
+    url=app.config.get('RESPONSE_CACHE_URL')))
+
+# seconds a catalog version lives in the response cache backend, flushing the
+# cache starts a new version
+CATALOG_VERSION_TTL = 30 * 24 * 3600
+
+# (tag, time read) of the catalog version this process last read
+catalog_version_read = None
+
+def catalog_version():
+    '''
+    Returns the tag of the catalog version, the time the catalog cache was
+    last flushed.  Kept in the response cache backend so the worker processes
+    sharing it agree on the version, and read from it at most once every
+    CATALOG_VERSION_CHECK_INTERVAL seconds.
+    '''
+    global catalog_version_read
+    read = catalog_version_read
+    if read is not None and (time.time() - read[1] <
+                             app.config.get('CATALOG_VERSION_CHECK_INTERVAL', 5)):
+        return read[0]
+    backend = response_cache.backend
+    tag = backend.get('catalog_version')
+    if tag is None:
+        tag = '%f' % time.time()
+        if not backend.add('catalog_version', tag, CATALOG_VERSION_TTL):
+            tag = backend.get('catalog_version') or tag
+    catalog_version_read = (tag, time.time())
+    return tag
+
+def forget_catalog_version():
+    '''Makes the next catalog_version() read the version from the backend'''
+    global catalog_version_read
+    catalog_version_read = None
+
+def result_version(sql_name, params, time_column):
+    '''
+    Returns (last modified, tag) of the result of a stored query, the newest
+    time_column and a hash of every row, computed by the database without
+    fetching the result.  Returns None for an empty result.
+    '''
+    sql = ('SELECT max(' + time_column + ') AS last_modified, '
+           'md5(string_agg(r::text, \',\' ORDER BY r::text)) AS tag FROM (' +
+           SQL[sql_name].strip().rstrip(';') + ') r')
+    row = db.engine.execute(sql, params).first()
+    if row is None or row['tag'] is None:
+        return None
+    last_modified = row['last_modified']
+    if not isinstance(last_modified, datetime):
+        last_modified = dateparse(last_modified, ignoretz=True)
+    return last_modified, row['tag']
+
+def wants_stream(beg_date, end_date):
+    """True if a result spanning beg_date to end_date should be streamed"""
+    return (app.config.get('STREAMING', False) and
+            (end_date - beg_date).days >= app.config.get('STREAMING_MIN_DAYS', 31))
+
+def series_columns_result(members, table, time='measure_ts',
+                          columns=(('value', 'obs_value', 'float64'),)):
+    """A ColumnarResult of the time and value columns of a table of
+       observations, converted as whole arrays"""
+    arrays = OrderedDict([
+        ('time', np.asarray(table[time].values, dtype='datetime64[s]'))])
+    for name, column, dtype in columns:
+        arrays[name] = np.asarray(table[column].values, dtype=dtype)
+    if len(table) and members:
+        members['report_name'] = table.iloc[-1]['report_name']
+        members['units'] = table.iloc[-1]['units']
+    return ColumnarResult(members, arrays)
+
+def series_result(measurement, table):
+    """The QueryData result for a table of the observations of a series"""
+    if len(table) < 1:
+        return {}
+    return {
+        'measurement' : measurement,
+        'report_name' : table.iloc[-1]['report_name'],
+        'units' : table.iloc[-1]['units'],
+        'values' : {
+            'time' : format_times(table['measure_ts']),
+            'value' : table['obs_value'].values.tolist()
+        }
+    }
+
+# XML-RPC fault codes, per the xmlrpc-epi interoperability specification
+METHOD_NOT_FOUND = -32601
+INVALID_PARAMS = -32602
+APPLICATION_ERROR = -32500
+
+multicall_pool = None
+multicall_pool_lock = Lock()
+
+def get_multicall_pool():
+    """The worker pool shared by every multicall in this process"""
+    global multicall_pool
+    with multicall_pool_lock:
+        if multicall_pool is None:
+            multicall_pool = ThreadPool(app.config.get('MULTICALL_WORKERS', 4))
+    return multicall_pool
+
+def fault(code, message):
+    return {'faultCode': code, 'faultString': message}
+
+def marshallable(value):
+    """Returns value with nested OrderedDicts, which xmlrpclib encodes as
+       instances, converted to dicts"""
+    if isinstance(value, dict):
+        return dict((k, marshallable(v)) for k, v in value.iteritems())
+    if isinstance(value, (list, tuple)):
+        return [marshallable(v) for v in value]
+    return value
+
+def call_method(environ, method_name, params, has_key=False):
+    """
+    Calls method_name with the positional params in a request context of its
+    own, so that calls can run concurrently.  Returns a (result, fault) tuple,
+    one of which is None.  API keys are checked by the caller, once for every
+    call, params only end with one if has_key.
+    """
+    method = methods.get(method_name)
+    if method is None or method.resource is MultiCall:
+        return None, fault(METHOD_NOT_FOUND, 'Unknown method %s' % method_name)
+    if not isinstance(params, (list, tuple)):
+        return None, fault(INVALID_PARAMS, 'params must be an array')
+    with app.request_context(environ):
+        request.args = method.bind(params, has_key)
+        try:
+            return method.resource().get(), None
+        except Exception as e:
+            app.logger.exception('%s failed in multicall', method_name)
+            return None, fault(APPLICATION_ERROR, e.message or repr(e))
+
+def call_methods(calls, has_key=False):
+    """
+    Runs the (method_name, params) calls on the multicall worker pool and
+    returns their (result, fault) tuples in order.  Pass has_key when the
+    params of each call end with the API key, as in a JSON-RPC batch.
+    """
+    max_calls = app.config.get('MULTICALL_MAX_CALLS', 100)
+    if len(calls) > max_calls:
+        raise ValueError('A multicall may hold at most %d calls' % max_calls)
+    environ = request.environ
+    if len(calls) < 2:
+        return [call_method(environ, name, params, has_key)
+                for name, params in calls]
+    return get_multicall_pool().map(
+        lambda call: call_method(environ, call[0], call[1], has_key), calls)
+
+def split_list(value):
+    """Returns an array argument as a list, also accepting a comma separated
+       string"""
+    if isinstance(value, basestring):
+        return [v.strip() for v in value.split(',') if v.strip()]
+    return list(value or [])
+
 class BaseResource(Resource):
     """Base resource which other API endpoints inherit.  Returns a simple
        JSON response, or an XMLRPC response if XML is requested"""
     # consider renaming to avoid confusion with the dict method
     keys = None
+    # further arguments a call may pass after the keys, before the API key
+    optional_keys = []
     return_type = "string"
-    def __init__(self):
-        self.res = self.result_simple()
+    # the result of a call passing unchanged_since when the result has not
+    # changed since
+    unchanged_result = {}
+
+    @classmethod
+    def version(cls):
+        """(last modified, tag) identifying the result for the request args,
+           for conditional requests, or None if the result is not versioned.
+           Catalog results are versioned by a digest of the cached result,
+           which is queried, or found in the catalog cache, to version it."""
+        if cls.__name__ in app.config.get('CATALOG_CACHE_TTL', {}):
+            resource = cls()
+            resource.get()
+            return resource.result_version
+        return None
+
+    @property
+    def res(self):
+        """The result of result_simple(), queried on first access and
+           memoized for the rest of the request"""
+        if not hasattr(self, '_res'):
+            self._res = self.result_simple()
+        return self._res
+
+    @res.setter
+    def res(self, value):
+        self._res = value
 
     def get(self):
         """Responds to GET request and provides a JSON result"""
@@ -65,9 +274,34 @@ class BaseResource(Resource):
                                   If a string is supplied, it will use an
                                   sql file with the same name as the string,
                                   minus the extension
+
+        Results are cached in process when the resource has a TTL configured
+        in CATALOG_CACHE_TTL.  The cache key holds the catalog version, so a
+        flush through any worker invalidates the entries of every worker.
+        Cached results are stored with their version, the time they were
+        queried and a digest of the result, set as result_version.
         """
         sql_name = (self.__class__.__name__ if not sql_name_override else
                     sql_name_override)
+        ttl = app.config.get('CATALOG_CACHE_TTL', {}).get(self.__class__.__name__)
+        if ttl:
+            key = (sql_name, result_only, singleton_result, reflect_params,
+                   tuple(request.args.get(k) for k in self.keys or []),
+                   catalog_version())
+            entry = catalog_cache.get(key)
+            if entry is MISSING:
+                results = self._result_simple(sql_name, result_only,
+                                              singleton_result, reflect_params)
+                digest = hashlib.sha1(json_dumps(results)).hexdigest()
+                entry = (results, (datetime.utcnow(), digest))
+                catalog_cache.set(key, entry, ttl)
+            results, self.result_version = entry
+            return results
+        return self._result_simple(sql_name, result_only, singleton_result,
+                                   reflect_params)
+
+    def _result_simple(self, sql_name, result_only, singleton_result,
+                       reflect_params):
         res = db.engine.execute(SQL[sql_name], request.args)
         res_vals = zip(*res.fetchall())
         if not result_only:
@@ -94,31 +328,35 @@ class BaseResource(Resource):
         return results
 
     @classmethod
-    def get_description(cls):
-        if 'xml' in request.content_type:
-            protocol = 'XML-RPC'
-        else:
-            protocol = 'JSON-RPC'
+    def get_description(cls, protocol):
+        """The system.methodHelp string for protocol, XML-RPC or JSON-RPC"""
         resource = getattr(cls, 'resource_name', None) or cls.__name__
-        args = copy(cls.keys)
+        args = ['string %s[req]' % keyname for keyname in cls.keys or []]
+        args += ['string %s[opt]' % keyname for keyname in cls.optional_keys]
         if check_api_key_and_req_type in cls.method_decorators:
-            args += ['api_key']
-        arguments = ', '.join(['string %s[req]' % keyname for keyname in args or []])
+            args += ['string api_key[req]']
+        arguments = ', '.join(args)
         description = 'CDRH %(protocol)s %(resource)s Function (%(arguments)s)' % locals()
         return getattr(cls, 'helpstring', None) or description
 
+@register('ListConstellations')
 class ListConstellations(BaseResource):
     keys = []
+    optional_keys = ['unchanged_since']
     method_decorators = [check_api_key_and_req_type]
+    unchanged_result = []
     def get(self):
         return self.result_simple(result_only=True)
 
 
+@register('ListPlatforms')
 class ListPlatforms(BaseResource):
     keys = ['constellation']
+    optional_keys = ['unchanged_since']
     method_decorators = [check_api_key_and_req_type]
 
 
+@register('GetNumberMeasurements')
 class GetNumberMeasurements(BaseResource):
     keys = ['constellation', 'station', 'measurement',
             'beg_date', 'end_date']
@@ -126,166 +364,235 @@ class GetNumberMeasurements(BaseResource):
     def get(self):
         return self.result_simple(result_only=True, singleton_result=True)
 
+@register('LastMeasurementTime')
 class LastMeasurementTime(BaseResource):
     keys = ['constellation', 'station', 'measurement']
     method_decorators = [check_api_key_and_req_type]
     def get(self):
         return str(self.result_simple(result_only=True, singleton_result=True))
 
+@register('RetrieveCurrentReadings')
 class RetrieveCurrentReadings(BaseResource):
     keys = ['constellation', 'station']
+    optional_keys = ['unchanged_since']
     method_decorators = [check_api_key_and_req_type]
+    # measurements which are never reported as current readings
+    blacklist = [
+        'sea_water_freezing_point',
+        'error_count'
+    ]
     def __init__(self):
-        sql_name = self.__class__.__name__
         self.constellation = request.args.get('constellation', 'cbibs')
         self.station = request.args.get('station')
-        now = datetime.utcnow()
-        start_date = now - relativedelta(weeks=2)
-        params = {'constellation':self.constellation, 'station':self.station, 'start_date':start_date}
-        self.table = pd.read_sql(SQL[sql_name], db.engine, params=params)
-        self.table = self.table[~self.table['obs_value'].isnull()]
-        self.table = self.table[~self.table['primary_qc'].isin([3,4])]
-        blacklist = [
-            'sea_water_freezing_point',
-            'error_count'
-        ]
-        self.table = self.table[~self.table['measurement'].isin(blacklist)]
-        self.table = self.table.sort(['measure_ts', 'measurement'])
-    def get(self):
-        '''
-        '''
 
+    @classmethod
+    def query_params(cls):
+        return {
+            'constellation': request.args.get('constellation', 'cbibs'),
+            'station': request.args.get('station'),
+            'start_date': datetime.utcnow() - relativedelta(weeks=2),
+            'blacklist': cls.blacklist
+        }
+
+    @classmethod
+    def version(cls):
+        return result_version(cls.__name__, cls.query_params(), 'r.measure_ts')
+
+    @property
+    def table(self):
+        """The current readings, queried on first access.  One row per
+           measurement, QC and blacklist filtering done in SQL"""
+        if not hasattr(self, '_table'):
+            self._table = pd.read_sql(SQL[self.__class__.__name__], db.engine,
+                                      params=self.query_params())
+        return self._table
+
+    def get(self):
         '''
         Table has
         - measure_ts
         - measurement (name+depth)
+        - report_name
         - obs_value
         - canonical_units
-        - primary_qc
         '''
-
-
-        variables = self.table['measurement'].unique()
-        values = []
-        times = []
-        units = []
-        report_names = []
-        for variable in variables:
-            row = self.table[(self.table['measurement'] == variable)].iloc[-1]
-            times.append(row['measure_ts'].strftime('%Y-%m-%d %H:%M:%S'))
-            values.append(row['obs_value'].item())
-            units.append(row['canonical_units'])
-            report_names.append(row['report_name'])
         self.res = OrderedDict([
             (u'constellation', self.constellation),
             (u'station', self.station),
-            (u'measurement',tuple(variables)),
-            (u'time', times),
-            (u'value', values),
-            (u'units', units),
-            (u'report_name', report_names)
+            (u'measurement', tuple(self.table['measurement'])),
+            (u'time', format_times(self.table['measure_ts'])),
+            (u'value', self.table['obs_value'].values.tolist()),
+            (u'units', self.table['canonical_units'].tolist()),
+            (u'report_name', self.table['report_name'].tolist())
         ])
 
         return self.res
 
+@register('ListStationsWithParam')
 class ListStationsWithParam(BaseResource):
     keys = ['constellation', 'parameter']
+    optional_keys = ['unchanged_since']
     method_decorators = [check_api_key_and_req_type]
+    unchanged_result = []
     def get(self):
         return self.result_simple(result_only=True)
 
+@register('ListParameters')
 class ListParameters(BaseResource):
     keys = ['constellation', 'station']
+    optional_keys = ['unchanged_since']
     method_decorators = [check_api_key_and_req_type]
+    unchanged_result = []
     def get(self):
         return self.result_simple(result_only=True)
 
+@register('QueryData')
 class QueryData(BaseResource):
-    """Fetches data within a time range"""
+    """Fetches data within a time range.  Given since, a timestamp or the
+       cursor of a previous result, only the observations after it are
+       fetched and the result holds the cursor to pass next."""
     keys = ['constellation', 'station', 'measurement',
             'beg_date', 'end_date']
+    optional_keys = ['since']
     method_decorators = [check_api_key_and_req_type]
+    # columns of the table of a series which does not resolve
+    table_columns = SERIES_COLUMNS
     def __init__(self, sql_name=None):
-        sql_name = sql_name or self.__class__.__name__
+        self.sql_name = sql_name or self.__class__.__name__
         self.constellation = request.args.get('constellation', 'CBIBS')
         self.station = request.args.get('station')
-        beg_date = dateparse(request.args.get('beg_date'), ignoretz=True)
-        end_date = dateparse(request.args.get('end_date'), ignoretz=True)
-        params = {
-            'constellation': self.constellation,
-            'station': self.station,
-            'beg_date': beg_date.isoformat() + 'Z',
-            'end_date': end_date.isoformat() + 'Z'
-        }
-        self.table = pd.read_sql(SQL[sql_name], db.engine, params=params)
-        self.table = self.table[self.table['obs_value'].notnull()]
-        self.table = self.table[self.table['measurement'] == request.args.get('measurement')]
-        self.table = self.table[~self.table['primary_qc'].isin([3,4])]
-        self.table = self.table.sort(['measure_ts'])
-
+        self.beg_date = dateparse(request.args.get('beg_date'), ignoretz=True)
+        self.end_date = dateparse(request.args.get('end_date'), ignoretz=True)
+        self.since = request.args.get('since')
+        if self.since:
+            # the range starts after since, the query seeks past it on the
+            # f_observation (station, variable, location, measure_ts) index
+            self.beg_date = max(self.beg_date, decode_since(self.since))
+        self.series = resolve_series(self.constellation, self.station,
+                                     request.args.get('measurement'))
+        # further parameters of the query named by sql_name
+        self.sql_params = {}
+
+    @property
+    def table(self):
+        """Observations of the series within the time range, queried on first
+           access.  QC and null filtering and ordering are done by the query
+           itself"""
+        if not hasattr(self, '_table'):
+            if self.series is None:
+                self._table = pd.DataFrame(columns=self.table_columns)
+            else:
+                self._table = query_series(self.series,
+                                           self.beg_date.isoformat() + 'Z',
+                                           self.end_date.isoformat() + 'Z',
+                                           self.sql_name, **self.sql_params)
+        return self._table
+
+    def cursor(self):
+        """The cursor resuming after the newest observation of the result"""
+        if len(self.table):
+            return encode_cursor(self.table['measure_ts'].iloc[-1])
+        return encode_cursor(self.beg_date)
 
     def get(self):
+        result = series_result(request.args.get('measurement'), self.table)
+        if self.since:
+            result['cursor'] = self.cursor()
+        return result
+
+    def columns(self):
+        result = series_columns_result(
+            OrderedDict([('measurement', request.args.get('measurement'))]),
+            self.table)
+        if self.since:
+            result.members['cursor'] = self.cursor()
+        return result
+
+    def stream(self):
+        """Returns the result as StreamedColumns read from a server side
+           cursor when the time range is long enough, otherwise as get().
+           Results after a since cursor are never streamed."""
+        if self.since or not wants_stream(self.beg_date, self.end_date):
+            return self.get()
+        batches = stream_series(self.series, self.beg_date.isoformat() + 'Z',
+                                self.end_date.isoformat() + 'Z',
+                                app.config.get('STREAMING_BATCH_SIZE', 5000),
+                                self.sql_name)
+        first = next(batches, None)
+        if first is None:
+            # no observations, same result as get()
+            self._table = pd.DataFrame(columns=self.table_columns)
+            return self.get()
+        return self.streamed_result(first[0],
+                                    series_columns(chain([first], batches)))
+
+    def streamed_result(self, row, batches):
+        members = OrderedDict([
+            ('measurement', request.args.get('measurement')),
+            ('report_name', row['report_name']),
+            ('units', row['units'])
+        ])
+        return StreamedColumns(members, ['time', 'value'], batches,
+                               parent='values')
 
-        if len(self.table) < 1:
-            return {}
-        retval = {
-            'measurement' : request.args.get('measurement'),
-            'report_name' : self.table.iloc[-1]['report_name'],
-            'units' : self.table.iloc[-1]['units'],
-            'values' : {
-                'time' : [t.strftime('%Y-%m-%d %H:%M:%S') for t in self.table['measure_ts']],
-                'value' : self.table['obs_value'].values.tolist()
-            }
-        }
-        return retval
-
+@register('RetrieveCurrentSuperSet')
 class RetrieveCurrentSuperSet(BaseResource):
     keys = ['superset']
+    optional_keys = ['unchanged_since']
     method_decorators = [check_api_key_and_req_type]
     def get(self):
         return self.result_simple()
 
+    @classmethod
+    def version(cls):
+        return result_version(cls.__name__, request.args, 'r."time"')
+
+@register('system.listMethods', namespaces=())
 class ListMethods(BaseResource):
     keys = []
     def __init__(self):
-        self.res = routing_dict.keys()
+        self.res = method_names
 
     def get(self):
         return self.res
 
+@register('system.methodHelp', namespaces=())
 class MethodHelp(BaseResource):
     keys = ['methodname']
     def __init__(self):
-        self.res = routing_dict[request.args['methodname']].get_description()
+        protocol = 'XML-RPC' if is_xml(request.content_type) else 'JSON-RPC'
+        self.res = methods[request.args['methodname']].help[protocol]
 
     def get(self):
         return self.res
 
+@register('system.methodSignature', namespaces=())
 class MethodSignature(BaseResource):
     keys = ['methodname']
     def __init__(self):
-        cls = routing_dict[request.args['methodname']]
-        args = cls.keys or []
-        self.res = [[cls.return_type] + ["string" for s in args]] # Nested lists on purpose
+        self.res = methods[request.args['methodname']].signature
 
+@register('system.getCapabilities', namespaces=())
 class GetCapabilities(BaseResource):
     keys = []
-    def __init__(self):
-        self.res = {
-            "introspection": {
-                "specUrl": "http://phpxmlrpc.sourceforge.net/doc-2/ch10.html",
-                "specVersion": 2
-            },
-            "json-rpc": {
-                "specUrl": "http://json-rpc.org/wiki/specification",
-                "specVersion": 1
-            },
-            "xmlrpc": {
-                "specUrl": "http://www.xmlrpc.com/spec",
-                "specVersion": 1
-            }
+    capabilities = {
+        "introspection": {
+            "specUrl": "http://phpxmlrpc.sourceforge.net/doc-2/ch10.html",
+            "specVersion": 2
+        },
+        "json-rpc": {
+            "specUrl": "http://json-rpc.org/wiki/specification",
+            "specVersion": 1
+        },
+        "xmlrpc": {
+            "specUrl": "http://www.xmlrpc.com/spec",
+            "specVersion": 1
         }
+    }
+    def __init__(self):
+        self.res = self.capabilities
 
+@register('GetStationStatus')
 class GetStationStatus(BaseResource):
     keys = ['constellation', 'station']
     method_decorators = [check_api_key_and_req_type]
@@ -293,6 +600,7 @@ class GetStationStatus(BaseResource):
     def get(self):
         return int(not self.res)
 
+@register('QueryDataRaw')
 class QueryDataRaw(BaseResource):
     keys = ['constellation', 'station', 'measurement', 'beg_date', 'end_date']
     method_decorators = [check_api_key_and_req_type]
@@ -308,8 +616,44 @@ class QueryDataRaw(BaseResource):
             }
         }
 
+    def columns(self):
+        """The result read into a DataFrame, with its times as timestamps,
+           so the columns are converted as whole arrays"""
+        table = pd.read_sql(SQL[self.__class__.__name__], db.engine,
+                            params=dict(request.args))
+        members = OrderedDict()
+        if len(table):
+            members['measurement'] = table['measurement'].iloc[0]
+        return series_columns_result(members, table,
+                                     columns=[('value', 'value', 'float64')])
+
+    def stream(self):
+        """Returns the result as StreamedColumns read from a server side
+           cursor when the time range is long enough, otherwise as get()"""
+        beg_date = dateparse(request.args.get('beg_date'), ignoretz=True)
+        end_date = dateparse(request.args.get('end_date'), ignoretz=True)
+        if not wants_stream(beg_date, end_date):
+            return self.get()
+        batches = stream_query(self.__class__.__name__, request.args,
+                               app.config.get('STREAMING_BATCH_SIZE', 5000))
+        first = next(batches, None)
+        if first is None:
+            return self.get()
+        members = OrderedDict([
+            ('measurement', first[0]['measurement']),
+            ('report_name', first[0]['report_name']),
+            ('units', first[0]['units'])
+        ])
+        columns = (([row['time'] for row in rows],
+                    [float(row['value']) for row in rows])
+                   for rows in chain([first], batches))
+        return StreamedColumns(members, ['time', 'value'], columns,
+                               parent='values')
+
+@register('GetMetaDataLocation', BOTH_NAMESPACES)
 class GetMetaDataLocation(BaseResource):
     keys = ['constellation', 'station']
+    optional_keys = ['unchanged_since']
     method_decorators = [check_api_key_and_req_type]
 
     def get(self):
@@ -318,8 +662,10 @@ class GetMetaDataLocation(BaseResource):
             'longitude':self.res['longitude'][0]
         }
 
+@register('QueryDataSimple', BOTH_NAMESPACES)
 class QueryDataSimple(QueryData):
     keys = ['constellation', 'station', 'measurement', 'beg_date', 'end_date']
+    optional_keys = ['since']
     method_decorators = [check_api_key_and_req_type]
 
     def __init__(self):
@@ -327,75 +673,199 @@ class QueryDataSimple(QueryData):
 
     def get(self):
         if len(self.table) < 1:
-            return {'time':[], 'value':[]}
-        return {
-            'time' : [t.strftime('%Y-%m-%d %H:%M:%S') for t in self.table['measure_ts']],
-            'value' : self.table['obs_value'].values.tolist()
-        }
+            result = {'time':[], 'value':[]}
+        else:
+            result = {
+                'time' : format_times(self.table['measure_ts']),
+                'value' : self.table['obs_value'].values.tolist()
+            }
+        if self.since:
+            result['cursor'] = self.cursor()
+        return result
 
+    def streamed_result(self, row, batches):
+        return StreamedColumns(OrderedDict(), ['time', 'value'], batches)
+
+    def columns(self):
+        result = series_columns_result(OrderedDict(), self.table)
+        if self.since:
+            result.members['cursor'] = self.cursor()
+        return result
+
+@register('QueryDataByTime')
 class QueryDataByTime(QueryData):
     keys = ['constellation', 'station', 'measurement', 'beg_date', 'end_date']
+    optional_keys = []
     method_decorators = [check_api_key_and_req_type]
     def __init__(self):
         QueryData.__init__(self, 'QueryData')
 
+    # rows rendered between the chunks of a streamed document
+    rows_per_chunk = 500
+
+    def rows(self):
+        """Generates the (time, measurement, value, units) rows of the
+           document, read from a server side cursor for long time ranges"""
+        if not wants_stream(self.beg_date, self.end_date):
+            return izip(format_times(self.table['measure_ts']),
+                        self.table['measurement'].tolist(),
+                        self.table['obs_value'].tolist(),
+                        self.table['units'].tolist())
+        batches = stream_series(self.series, self.beg_date.isoformat() + 'Z',
+                                self.end_date.isoformat() + 'Z',
+                                app.config.get('STREAMING_BATCH_SIZE', 5000),
+                                self.sql_name)
+        return chain.from_iterable(
+            izip(format_times([row['measure_ts'] for row in batch]),
+                 [row['measurement'] for row in batch],
+                 [row['obs_value'] for row in batch],
+                 [row['units'] for row in batch])
+            for batch in batches)
+
+    def stream(self):
+        """Returns the document as StreamedText, rendered as it is written"""
+        template = j2.get_template('query_data_by_time.xml.j2')
+        chunks = template.stream(rows=self.rows())
+        # jinja yields about one piece per row, write them in larger chunks
+        chunks.enable_buffering(self.rows_per_chunk)
+        return StreamedText(chunks)
+
     def get(self):
         template = j2.get_template('query_data_by_time.xml.j2')
-        rows = []
-        for index, row in self.table.iterrows():
-            rows.append([
-                row['measure_ts'].strftime('%Y-%m-%d %H:%M:%s'),
-                row['obs_value'],
-                row['units']
-            ])
-        payload = template.render(rows=rows)
-        return payload
+        return template.render(rows=self.rows())
+
+@register('QueryDataAggregated', BOTH_NAMESPACES)
+class QueryDataAggregated(QueryData):
+    """Minimum, mean and maximum of a series per time bucket.  interval is
+       hour, day or month, or else the number of equal width buckets to
+       divide the time range into"""
+    keys = ['constellation', 'station', 'measurement', 'beg_date', 'end_date',
+            'interval']
+    optional_keys = []
+    method_decorators = [check_api_key_and_req_type]
+    intervals = ('hour', 'day', 'month')
+    table_columns = ['bucket', 'report_name', 'units', 'min', 'mean', 'max',
+                     'count']
+
+    def __init__(self):
+        QueryData.__init__(self)
+        interval = request.args.get('interval')
+        self.sql_params = {'interval': None, 'width': None,
+                           'origin': timegm(self.beg_date.timetuple())}
+        if interval in self.intervals:
+            self.sql_params['interval'] = interval
+        else:
+            try:
+                points = int(interval)
+            except (TypeError, ValueError):
+                points = 0
+            if points < 1:
+                raise ValueError('interval must be one of %s or a positive '
+                                 'number of points' % ', '.join(self.intervals))
+            span = (self.end_date - self.beg_date).total_seconds()
+            self.sql_params['width'] = max(span / points, 1)
 
+    def get(self):
+        if len(self.table) < 1:
+            return {}
+        return {
+            'measurement' : request.args.get('measurement'),
+            'report_name' : self.table.iloc[-1]['report_name'],
+            'units' : self.table.iloc[-1]['units'],
+            'interval' : request.args.get('interval'),
+            'values' : {
+                'time' : format_times(self.table['bucket']),
+                'min' : self.table['min'].values.tolist(),
+                'mean' : self.table['mean'].values.tolist(),
+                'max' : self.table['max'].values.tolist(),
+                'count' : self.table['count'].values.tolist()
+            }
+        }
+
+    def stream(self):
+        # the number of buckets is bounded by the interval, nothing to stream
+        return self.get()
+
+    def columns(self):
+        result = series_columns_result(
+            OrderedDict([('measurement', request.args.get('measurement'))]),
+            self.table, 'bucket',
+            [('min', 'min', 'float64'), ('mean', 'mean', 'float64'),
+             ('max', 'max', 'float64'), ('count', 'count', 'int64')])
+        result.members['interval'] = request.args.get('interval')
+        return result
+
+@register('QueryDataMulti', BOTH_NAMESPACES)
+class QueryDataMulti(BaseResource):
+    """Fetches every combination of several stations and measurements within
+       a time range with a single query.  Returns the QueryData result of each
+       series keyed by station and then measurement"""
+    keys = ['constellation', 'stations', 'measurements', 'beg_date',
+            'end_date']
+    method_decorators = [check_api_key_and_req_type]
+
+    def __init__(self):
+        self.constellation = request.args.get('constellation', 'CBIBS')
+        self.stations = split_list(request.args.get('stations'))
+        self.measurements = split_list(request.args.get('measurements'))
+        self.beg_date = dateparse(request.args.get('beg_date'), ignoretz=True)
+        self.end_date = dateparse(request.args.get('end_date'), ignoretz=True)
+
+    @property
+    def table(self):
+        """Observations of every resolved series within the time range,
+           queried on first access"""
+        if not hasattr(self, '_table'):
+            series = resolve_many(self.constellation, self.stations,
+                                  self.measurements)
+            self._table = query_many(series.values(),
+                                     self.beg_date.isoformat() + 'Z',
+                                     self.end_date.isoformat() + 'Z')
+        return self._table
+
+    def get(self):
+        results = dict((station, dict((measurement, {}) for measurement in
+                                      self.measurements))
+                       for station in self.stations)
+        for (station, measurement), table in self.table.groupby(['station', 'measurement']):
+            results[station][measurement] = series_result(measurement, table)
+        return results
+
+@register('system.multicall', namespaces=())
+class MultiCall(BaseResource):
+    """system.multicall, many calls in one request.  calls is an array of
+       structs holding a methodName and its params, without the API key which
+       is given once for every call.  Returns an array holding a one element
+       array with the result of each call or a fault struct in its place"""
+    keys = ['calls']
+    method_decorators = [check_api_key_and_req_type]
+    return_type = "array"
+
+    def __init__(self):
+        calls = request.args.get('calls')
+        if not isinstance(calls, (list, tuple)):
+            raise ValueError('system.multicall expects an array of calls')
+        self.calls = [(call.get('methodName'), call.get('params', []))
+                      if isinstance(call, dict) else (None, [])
+                      for call in calls]
+
+    def get(self):
+        return [fault_value or [marshallable(result)]
+                for result, fault_value in call_methods(self.calls)]
+
+@register('ListQACodes')
 class ListQACodes(BaseResource):
     keys = []
+    optional_keys = ['unchanged_since']
     method_decorators = [check_api_key_and_req_type]
 
 
-# TODO: could dry this up by making a helper function for the API
-# instead of repeating every time
-routing_dict = {
-         'ListConstellations': ListConstellations,
-         'ListPlatforms': ListPlatforms,
-         'ListStationsWithParam': ListStationsWithParam,
-         'QueryData': QueryData,
-         'GetNumberMeasurements': GetNumberMeasurements,
-         'LastMeasurementTime': LastMeasurementTime,
-         'RetrieveCurrentReadings': RetrieveCurrentReadings,
-         'ListParameters' : ListParameters,
-         'RetrieveCurrentSuperSet' : RetrieveCurrentSuperSet,
-         'system.listMethods' : ListMethods,
-         'system.methodHelp' : MethodHelp,
-         'system.methodSignature' : MethodSignature,
-         'system.getCapabilities' : GetCapabilities,
-         'GetStationStatus' : GetStationStatus,
-         'QueryDataRaw' : QueryDataRaw,
-         'GetMetaDataLocation' : GetMetaDataLocation,
-         'QueryDataSimple' : QueryDataSimple,
-         'QueryDataByTime': QueryDataByTime,
-         'ListQACodes' : ListQACodes,
-         'xmlrpc_cdrh.ListStationsWithParam' : ListStationsWithParam,
-         'xmlrpc_cdrh.RetrieveCurrentReadings' : RetrieveCurrentReadings,
-         'xmlrpc_cdrh.LastMeasurementTime' : LastMeasurementTime,
-         'xmlrpc_cdrh.QueryData' : QueryData,
-         'xmlrpc_cdrh.ListConstellations' : ListConstellations,
-         'xmlrpc_cdrh.ListQACodes' : ListQACodes,
-         'xmlrpc_cdrh.ListPlatforms' : ListPlatforms,
-         'xmlrpc_cdrh.ListParameters' : ListParameters,
-         'xmlrpc_cdrh.GetNumberMeasurements' : GetNumberMeasurements,
-         'xmlrpc_cdrh.RetrieveCurrentSuperSet' : RetrieveCurrentSuperSet,
-         'xmlrpc_cdrh.GetStationStatus' : GetStationStatus,
-         'xmlrpc_cdrh.QueryDataByTime' : QueryDataByTime,
-         'xmlrpc_cdrh.GetMetaDataLocation' : GetMetaDataLocation,
-         'xmlrpc_cdrh.QueryDataSimple' : QueryDataSimple,
-         'xmlrpc_cdrh.QueryDataRaw' : QueryDataRaw,
-         'jsonrpc_cdrh.GetMetaDataLocation' : GetMetaDataLocation,
-         'jsonrpc_cdrh.QueryDataSimple' : QueryDataSimple
-        }
+# method names to their resources, for compatibility
+routing_dict = dict((name, method.resource) for name, method in
+                    methods.iteritems())
+
+# system.listMethods result
+method_names = sorted(methods)
 
 
 class BaseApi(Resource):
@@ -406,8 +876,16 @@ class BaseApi(Resource):
         Resource.__init__(self)
         self.representations = {
             'text/xml' : output_xml,
-            'application/json' : output_json
+            'application/json' : output_json,
+            NPZ_MEDIATYPE : output_npz
+        }
+        # encoders for StreamedColumns results
+        self.stream_representations = {
+            'text/xml' : stream_xml,
+            'application/json' : stream_json
         }
+        # (ETag, Last-Modified) of the result of a versioned method
+        self.validators = None
 
     def get(self):
 
@@ -416,29 +894,16 @@ class BaseApi(Resource):
                             ('result', None)])
 
     def parse_args(self):
-        if 'xml' in request.content_type:
-            return self.parse_xml()
-        return self.parse_json()
-
-    def parse_json(self):
-        # TODO: handle both jsonrpc and xmlrpc requests
-        json_req = request.get_json(force=True)
-        # grab the api method
-        self.api_endpoint = routing_dict[json_req.pop('method')]
-        if 'params' in json_req:
-            params = json_req['params']
-            # consider eliminating side effects, makes this difficult
-            # to understand
-            if self.api_endpoint.keys:
-                json_req.update(dict(zip(self.api_endpoint.keys, json_req['params'])))
-
-        return json_req
-
-    def parse_xml(self):
-        payload = xmlrpc_client.loads(request.data)
-        # load xmlrpc method
-        self.api_endpoint = routing_dict[payload[1]]
-        return dict(zip(self.api_endpoint.keys, payload[0]))
+        """Returns the request args of the call, keyed by the endpoint's keys"""
+        call = decode_call()
+        if not isinstance(call, RpcCall):
+            # a JSON-RPC batch
+            self.method = None
+            return call
+        self.method = methods.get(call.method)
+        if self.method is None:
+            raise BadRequest('Unknown method %s' % call.method)
+        return self.method.bind(call.params, has_key=True)
 
     def dispatch_request(self, *args, **kwargs):
 
@@ -455,35 +920,177 @@ class BaseApi(Resource):
         resp = meth(*args, **kwargs)
 
         if isinstance(resp, ResponseBase):  # There may be a better way to test
-            return resp
+            return self.finish_response(resp)
 
+        mediatype = self.negotiate_mediatype()
+        if mediatype is not None:
+            data, code, headers = unpack(resp)
+            resp = self.representations[mediatype](data, code, headers)
+            resp.headers['Content-Type'] = mediatype
+            resp = self.finish_response(resp)
+
+        return resp
+
+    def finish_response(self, response):
+        '''
+        Adds the validators of a versioned result to a response and
+        compresses it
+        '''
+        if self.validators is not None and response.status_code in (200, 304):
+            etag, last_modified = self.validators
+            response.set_etag(etag, weak=True)
+            response.last_modified = last_modified
+        return compress_response(response)
+
+    def negotiate_mediatype(self):
+        '''
+        Returns the representation the response is encoded with, the best
+        match for the Accept header or else the request content type, or None
+        '''
         representations = self.representations or {}
 
         #noinspection PyUnresolvedReferences
-        mediatype = request.accept_mimetypes.best_match(representations, default=None)
+        mediatype = request.accept_mimetypes.best_match(
+            [m for m in representations if m not in BINARY_MEDIATYPES],
+            default=None)
+
+        # binary representations must be asked for by name, not by */*, and
+        # are only chosen over a text one the client prefers strictly less
+        quality = request.accept_mimetypes[mediatype] if mediatype else 0
+        accepted = dict(request.accept_mimetypes)
+        for binary in BINARY_MEDIATYPES:
+            if binary in representations and accepted.get(binary, 0) > quality:
+                return binary
+
         if mediatype in representations:
-            data, code, headers = unpack(resp)
-            resp = representations[mediatype](data, code, headers)
-            resp.headers['Content-Type'] = mediatype
-            return resp
+            return mediatype
         elif request.content_type in representations:
-            mediatype = request.content_type
-            data, code, headers = unpack(resp)
-            resp = representations[mediatype](data, code, headers)
-            resp.headers['Content-Type'] = mediatype
-            return resp
+            return request.content_type
+        return None
 
-        return resp
+    def cached_response(self, ttl, mediatype):
+        '''
+        Returns the encoded response for the current call from the shared
+        response cache, calling the endpoint and storing its encoded result on
+        a miss.  The result is stored along with its compressed variants, so
+        hits are sent in the accepted encoding as they are.  The endpoint's
+        method_decorators still apply to every hit.
+        '''
+        args = [request.args.get(k) for k in self.method.keys]
+        if self.validators is not None:
+            # cached under its ETag, so a versioned body matches its ETag
+            args.append(self.validators[0])
+        key = response_cache.make_key(self.method.name, args, mediatype)
+
+        def compute():
+            data = self.result_getter(self.method.resource(), mediatype)()
+            body = self.representations[mediatype](data, 200).get_data()
+            return pack_variants(encode_variants(body))
+
+        fetch = lambda: response_cache.get_or_compute(key, ttl, compute)
+        for wrapper in self.method.decorators:
+            fetch = wrapper(fetch)
+        variants = unpack_variants(fetch())
+        encoding = negotiate_encoding([e for e in variants if e])
+        response = make_response(variants[encoding or ''])
+        response.headers['Content-Type'] = mediatype
+        if encoding:
+            response.headers['Content-Encoding'] = encoding
+        response.vary.add('Accept-Encoding')
+        return response
+
+    def batch(self, calls):
+        """
+        Responds to a JSON-RPC batch, an array of calls as they would be sent
+        singly.  The API key of every call must be valid for any to run.
+        """
+        for call in calls:
+            method = methods.get(call.method)
+            if (method is not None and method.requires_key and
+                    call.api_key != app.config['API_KEY']):
+                return {'error': 'Incorrect API key, or no API key specified'}, 401
+        results = call_methods([(call.method, call.params) for call in calls],
+                               has_key=True)
+        response = make_response(json_dumps([
+            {'id': call.id, 'result': result, 'error': fault_value}
+            for call, (result, fault_value) in zip(calls, results)]))
+        response.headers['Content-Type'] = 'application/json'
+        return response
+
+    def result_getter(self, resource, mediatype):
+        '''
+        Returns the method of resource producing its result for mediatype,
+        columns() for the binary representations, stream() for long results
+        where it streams, otherwise get()
+        '''
+        return getattr(resource, self.method.producers.get(mediatype, 'get'))
+
+    def check_version(self, mediatype):
+        '''
+        Sets the validators of the result of a versioned method.  Returns
+        what to send instead of the result when the client already has it, a
+        304 response to a conditional GET or the unchanged_result of the
+        method for a call passing unchanged_since, otherwise None.  Only the
+        version is queried, the result is not computed.
+        '''
+        conditional = request.method in ('GET', 'HEAD')
+        if not conditional and not request.args.get('unchanged_since'):
+            # RPC calls can not be conditional, don't query the version
+            return None
+        version = self.method.resource.version
+        for wrapper in self.method.decorators:
+            version = wrapper(version)
+        version = version()
+        if version is None:
+            return None
+        last_modified, tag = version
+        # HTTP dates have a resolution of seconds
+        last_modified = last_modified.replace(microsecond=0)
+        args = [request.args.get(k) for k in self.method.keys]
+        etag = hashlib.sha1(json.dumps([self.method.name, args, mediatype,
+                                        tag])).hexdigest()
+        self.validators = (etag, last_modified)
+        if conditional:
+            if request.if_none_match:
+                if request.if_none_match.contains_weak(etag):
+                    return Response(status=304)
+            elif (request.if_modified_since is not None and
+                    last_modified <= request.if_modified_since):
+                return Response(status=304)
+        since = request.args.get('unchanged_since')
+        if since and last_modified <= dateparse(since, ignoretz=True):
+            return self.method.resource.unchanged_result
+        return None
 
     def post(self):
         request.args = self.parse_args()
+        if self.method is None:
+            return self.batch(request.args)
+        return self.respond()
 
+    def respond(self):
+        '''
+        Responds to a call of self.method with the request args
+        '''
         # call api endpoint with current request context
         # and switch request method to get
         try:
-            resource = self.api_endpoint()
-            get_method = resource.get
-            for wrapper in getattr(resource, 'method_decorators', []):
+            ttl = app.config.get('RESPONSE_CACHE_TTL', {}).get(self.method.name)
+            mediatype = self.negotiate_mediatype()
+            if (mediatype in BINARY_MEDIATYPES and
+                    mediatype not in self.method.producers):
+                return {'error': '%s has no %s representation' %
+                                 (self.method.name, mediatype)}, 406
+            unchanged = self.check_version(mediatype)
+            if unchanged is not None:
+                return unchanged
+            if ttl and mediatype:
+                return self.cached_response(ttl, mediatype)
+            # the resource is built within the decorators, which check the
+            # API key before its params are parsed
+            get_method = lambda: self.result_getter(self.method.resource(),
+                                                    mediatype)()
+            for wrapper in self.method.decorators:
                 get_method = wrapper(get_method)
             res = get_method()
         except UnauthorizedError as e:
@@ -493,9 +1100,41 @@ class BaseApi(Resource):
                 raise
             return {'error':e.message}, 400
 
+        if isinstance(res, (StreamedColumns, StreamedText)):
+            response = self.stream_representations[mediatype](res)
+            response.headers['Content-Type'] = mediatype
+            return response
+
         if request_wants_xml() or request.content_type == 'text/xml':
             return res
         return res
 
+class RestApi(BaseApi):
+    """REST style access to the RPC methods.  GET /api/<method> with the
+       keys of the method and the api_key as query string parameters responds
+       as the RPC call would, in JSON unless XML is named in Accept.  Results
+       of versioned methods carry an ETag and Last-Modified and are answered
+       with 304 Not Modified when the client's copy is current."""
+    def get(self, name):
+        self.method = methods.get(name)
+        if self.method is None:
+            return {'error': 'Unknown method %s' % name}, 404
+        request.args = request.args.to_dict()
+        return self.respond()
+
+    def post(self, name):
+        raise MethodNotAllowed(['GET'])
+
+    def negotiate_mediatype(self):
+        # JSON unless another type is named, the highest quality one wins and
+        # ties go to the first one listed
+        accepted = dict(request.accept_mimetypes)
+        named = [m for m in ('text/xml', 'application/json', NPZ_MEDIATYPE)
+                 if accepted.get(m, 0) > 0]
+        if not named:
+            return 'application/json'
+        return max(named, key=lambda m: accepted[m])
+
 
 api.add_resource(BaseApi, '/')
+api.add_resource(RestApi, '/api/<string:name>')
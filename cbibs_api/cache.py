@@ -0,0 +1,284 @@
+#!/usr/bin/env python
+#-*- coding: utf-8 -*-
+'''
+cbibs_api.cache
+~~~~~~~~~~~~~~~
+
+Caching of query results and encoded responses.  TTLCache holds results in
+process, ResponseCache holds encoded responses in a store that can be shared
+by every worker process on a host.
+
+Copyright 2015 RPS ASA
+See LICENSE.txt
+'''
+
+from collections import OrderedDict
+from threading import Lock, local
+import hashlib
+import json
+import os
+import sqlite3
+import time
+
+try:
+    import redis
+except ImportError:
+    redis = None
+
+# returned by TTLCache.get on a miss so that None can be cached
+MISSING = object()
+
+class TTLCache(object):
+    '''
+    A thread safe, size bounded cache.  Entries expire after their TTL and the
+    least recently used entry is evicted once max_entries is reached.
+    '''
+    def __init__(self, max_entries=512):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = Lock()
+
+    def get(self, key):
+        '''
+        Returns the value stored under key, or MISSING if there is no entry or
+        the entry has expired.
+        '''
+        with self._lock:
+            try:
+                expires, value = self._entries.pop(key)
+            except KeyError:
+                return MISSING
+            if expires < time.time():
+                return MISSING
+            # reinsert to mark as most recently used
+            self._entries[key] = (expires, value)
+            return value
+
+    def set(self, key, value, ttl):
+        '''
+        Stores value under key for ttl seconds
+        '''
+        with self._lock:
+            self._entries.pop(key, None)
+            while self._entries and len(self._entries) >= self.max_entries:
+                self._entries.popitem(last=False)
+            self._entries[key] = (time.time() + ttl, value)
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class CacheBackend(object):
+    '''
+    Interface for the stores behind ResponseCache.  Keys are strings, values
+    are byte strings and every entry expires after its TTL.
+    '''
+    def get(self, key):
+        '''Returns the value stored under key, or None'''
+        raise NotImplementedError
+
+    def set(self, key, value, ttl):
+        '''Stores value under key for ttl seconds'''
+        raise NotImplementedError
+
+    def add(self, key, value, ttl):
+        '''
+        Stores value under key for ttl seconds only if there is no live entry
+        for key.  Returns True if the value was stored.
+        '''
+        raise NotImplementedError
+
+    def delete(self, key):
+        raise NotImplementedError
+
+    def clear(self):
+        raise NotImplementedError
+
+class LocalBackend(CacheBackend):
+    '''
+    Per-process store, for single worker deployments
+    '''
+    def __init__(self, max_entries=512):
+        self.cache = TTLCache(max_entries)
+        self._lock = Lock()
+
+    def get(self, key):
+        value = self.cache.get(key)
+        return None if value is MISSING else value
+
+    def set(self, key, value, ttl):
+        self.cache.set(key, value, ttl)
+
+    def add(self, key, value, ttl):
+        with self._lock:
+            if self.cache.get(key) is not MISSING:
+                return False
+            self.cache.set(key, value, ttl)
+            return True
+
+    def delete(self, key):
+        self.cache.delete(key)
+
+    def clear(self):
+        self.cache.clear()
+
+class SqliteBackend(CacheBackend):
+    '''
+    Store kept in a SQLite database file, shared by every process which opens
+    the same path.
+    '''
+    def __init__(self, path):
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+        self._local = local()
+        with self._connection() as conn:
+            conn.execute('CREATE TABLE IF NOT EXISTS response_cache ('
+                         'key TEXT PRIMARY KEY, value BLOB, expires REAL)')
+
+    def _connection(self):
+        # sqlite3 connections can not be shared between threads
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            self._local.conn = conn
+        return conn
+
+    def get(self, key):
+        row = self._connection().execute(
+            'SELECT value FROM response_cache WHERE key = ? AND expires > ?',
+            (key, time.time())).fetchone()
+        return str(row[0]) if row else None
+
+    def set(self, key, value, ttl):
+        now = time.time()
+        with self._connection() as conn:
+            conn.execute('DELETE FROM response_cache WHERE expires < ?', (now,))
+            conn.execute('INSERT OR REPLACE INTO response_cache VALUES (?, ?, ?)',
+                         (key, buffer(value), now + ttl))
+
+    def add(self, key, value, ttl):
+        now = time.time()
+        with self._connection() as conn:
+            conn.execute('DELETE FROM response_cache WHERE key = ? AND expires < ?',
+                         (key, now))
+            cursor = conn.execute('INSERT OR IGNORE INTO response_cache VALUES (?, ?, ?)',
+                                  (key, buffer(value), now + ttl))
+            return cursor.rowcount == 1
+
+    def delete(self, key):
+        with self._connection() as conn:
+            conn.execute('DELETE FROM response_cache WHERE key = ?', (key,))
+
+    def clear(self):
+        with self._connection() as conn:
+            conn.execute('DELETE FROM response_cache')
+
+class RedisBackend(CacheBackend):
+    '''
+    Store kept in a Redis compatible server.  Requires the redis package.
+    '''
+    prefix = 'cbibs_api:'
+
+    def __init__(self, url):
+        if redis is None:
+            raise RuntimeError('The redis package is required for the redis '
+                               'response cache backend')
+        self.client = redis.StrictRedis.from_url(url)
+
+    def get(self, key):
+        return self.client.get(self.prefix + key)
+
+    def set(self, key, value, ttl):
+        self.client.setex(self.prefix + key, int(ttl), value)
+
+    def add(self, key, value, ttl):
+        return bool(self.client.set(self.prefix + key, value, ex=int(ttl),
+                                    nx=True))
+
+    def delete(self, key):
+        self.client.delete(self.prefix + key)
+
+    def clear(self):
+        for key in self.client.scan_iter(match=self.prefix + '*'):
+            self.client.delete(key)
+
+def create_backend(name, path=None, url=None, max_entries=512):
+    '''
+    Returns the CacheBackend named by name, one of local, sqlite or redis
+    '''
+    if name == 'sqlite':
+        return SqliteBackend(path)
+    if name == 'redis':
+        return RedisBackend(url)
+    if name == 'local':
+        return LocalBackend(max_entries)
+    raise ValueError('Unknown response cache backend %r' % name)
+
+class ResponseCache(object):
+    '''
+    Caches encoded responses in a CacheBackend.  Concurrent misses for the
+    same key, from threads in this process or from other processes sharing
+    the backend, are coalesced so that only one of them computes the value
+    while the others wait for it.
+    :param backend: CacheBackend holding the values
+    :param lock_timeout: seconds a miss waits for another worker to compute
+                         the value before computing it itself
+    :param poll_interval: seconds between checks while waiting
+    '''
+    def __init__(self, backend, lock_timeout=30, poll_interval=0.05):
+        self.backend = backend
+        self.lock_timeout = lock_timeout
+        self.poll_interval = poll_interval
+        # striped locks coalesce the threads of this process
+        self._locks = [Lock() for i in range(64)]
+
+    @staticmethod
+    def make_key(method_name, args, mediatype):
+        '''
+        Returns the key for a call to method_name with the positional args
+        encoded as mediatype
+        '''
+        raw = json.dumps([method_name, args, mediatype])
+        return hashlib.sha1(raw).hexdigest()
+
+    def get_or_compute(self, key, ttl, compute):
+        '''
+        Returns the value stored under key, calling compute and storing its
+        result for ttl seconds on a miss.
+        '''
+        value = self.backend.get(key)
+        if value is not None:
+            return value
+        with self._locks[hash(key) % len(self._locks)]:
+            value = self.backend.get(key)
+            if value is not None:
+                return value
+            lock_key = 'lock:' + key
+            deadline = time.time() + self.lock_timeout
+            locked = self.backend.add(lock_key, '1', self.lock_timeout)
+            while not locked and time.time() < deadline:
+                time.sleep(self.poll_interval)
+                value = self.backend.get(key)
+                if value is not None:
+                    return value
+                locked = self.backend.add(lock_key, '1', self.lock_timeout)
+            try:
+                value = compute()
+                self.backend.set(key, value, ttl)
+            finally:
+                if locked:
+                    self.backend.delete(lock_key)
+            return value
+
+    def clear(self):
+        self.backend.clear()
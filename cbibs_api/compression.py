@@ -0,0 +1,143 @@
+#!/usr/bin/env python
+#-*- coding: utf-8 -*-
+'''
+cbibs_api.compression
+~~~~~~~~~~~~~~~~~~~~~
+
+Content-Encoding negotiation for RPC responses.  Responses of at least
+COMPRESSION_MIN_BYTES are sent gzip or deflate encoded, or brotli encoded
+when the brotli package is installed and the client accepts it.  Streamed
+responses are compressed chunk by chunk with gzip or deflate.
+
+Cached responses are stored with every encoding of their body, see
+encode_variants, so a cache hit is sent without compressing it again.
+
+Copyright 2015 RPS ASA
+See LICENSE.txt
+'''
+
+from cbibs_api import app
+from flask import request
+import struct
+import zlib
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# in order of preference when the client accepts several equally
+ENCODINGS = ('br', 'gzip', 'deflate') if brotli else ('gzip', 'deflate')
+STREAM_ENCODINGS = ('gzip', 'deflate')
+
+COMPRESSIBLE_MIMETYPES = frozenset(['text/xml', 'application/json',
+                                    'text/csv', 'application/x-ndjson'])
+
+# marks a cache value packed by pack_variants
+VARIANTS_MAGIC = 'CBIBS-VARIANTS\n'
+
+def negotiate_encoding(available=ENCODINGS):
+    '''
+    Returns the encoding of available the request accepts best, or None
+    '''
+    if not app.config.get('COMPRESSION', True):
+        return None
+    return request.accept_encodings.best_match(available, default=None)
+
+def compress(data, encoding):
+    '''
+    Returns data encoded with encoding, br, gzip or deflate
+    '''
+    if encoding == 'br':
+        return brotli.compress(data, quality=app.config.get('BROTLI_QUALITY', 5))
+    compressor = _compressor(encoding)
+    return compressor.compress(data) + compressor.flush()
+
+def _compressor(encoding):
+    # zlib framing for deflate, as HTTP defines it, gzip framing for gzip
+    wbits = zlib.MAX_WBITS | 16 if encoding == 'gzip' else zlib.MAX_WBITS
+    return zlib.compressobj(app.config.get('COMPRESSION_LEVEL', 6),
+                            zlib.DEFLATED, wbits)
+
+def encode_variants(data):
+    '''
+    Returns a dict of encoding to data encoded with it for every available
+    encoding, with data itself under the empty string.  Data shorter than
+    COMPRESSION_MIN_BYTES is not compressed.  gzip and deflate share a single
+    deflate pass and differ only in their framing.
+    '''
+    variants = {'': data}
+    if len(data) < app.config.get('COMPRESSION_MIN_BYTES', 1024):
+        return variants
+    compressor = zlib.compressobj(app.config.get('COMPRESSION_LEVEL', 6),
+                                  zlib.DEFLATED, -zlib.MAX_WBITS)
+    stream = compressor.compress(data) + compressor.flush()
+    variants['gzip'] = ('\x1f\x8b\x08\x00\x00\x00\x00\x00\x00\xff' + stream +
+                        struct.pack('<II', zlib.crc32(data) & 0xffffffff,
+                                    len(data) & 0xffffffff))
+    # CMF 0x78 (deflate, 32K window), FLG 0x9c (default level, check bits)
+    variants['deflate'] = ('\x78\x9c' + stream +
+                           struct.pack('>I', zlib.adler32(data) & 0xffffffff))
+    if brotli:
+        variants['br'] = compress(data, 'br')
+    return variants
+
+def pack_variants(variants):
+    '''
+    Returns the dict of encoded bodies as a single byte string to cache
+    '''
+    return VARIANTS_MAGIC + ''.join('%s %d\n%s' % (encoding, len(body), body)
+                                    for encoding, body in variants.iteritems())
+
+def unpack_variants(value):
+    '''
+    Returns the dict of encoded bodies packed in value.  A value which was
+    not packed is returned as the only, unencoded, variant.
+    '''
+    if not value.startswith(VARIANTS_MAGIC):
+        return {'': value}
+    variants = {}
+    pos = len(VARIANTS_MAGIC)
+    while pos < len(value):
+        end = value.index('\n', pos)
+        encoding, size = value[pos:end].split(' ')
+        pos = end + 1 + int(size)
+        variants[encoding] = value[end + 1:pos]
+    return variants
+
+def _compress_chunks(chunks, encoding):
+    compressor = _compressor(encoding)
+    for chunk in chunks:
+        if isinstance(chunk, unicode):
+            chunk = chunk.encode('utf-8')
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+def compress_response(response):
+    '''
+    Compresses the body of a response with the encoding the request accepts
+    best, unless it is too short, already encoded or of a binary type
+    '''
+    if (response.status_code != 200 or
+            'Content-Encoding' in response.headers or
+            response.mimetype not in COMPRESSIBLE_MIMETYPES):
+        return response
+    response.vary.add('Accept-Encoding')
+    if response.is_streamed:
+        encoding = negotiate_encoding(STREAM_ENCODINGS)
+        if encoding is None:
+            return response
+        response.response = _compress_chunks(response.response, encoding)
+        response.headers.pop('Content-Length', None)
+    else:
+        data = response.get_data()
+        if len(data) < app.config.get('COMPRESSION_MIN_BYTES', 1024):
+            return response
+        encoding = negotiate_encoding()
+        if encoding is None:
+            return response
+        response.set_data(compress(data, encoding))
+    response.headers['Content-Encoding'] = encoding
+    return response
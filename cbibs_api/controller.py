@@ -7,8 +7,19 @@ cbibs_api.controller
 Application controller: defines the routes and application logic
 '''
 
-from flask import jsonify
+from flask import jsonify, request, Response, stream_with_context
 from cbibs_api import app, db
+from cbibs_api.api import catalog_cache, response_cache, forget_catalog_version
+from cbibs_api.compression import compress_response
+from cbibs_api.export import FORMATS
+from cbibs_api.series import resolve_series, stream_series
+from cbibs_api.utils import UnauthorizedError, jsonify_status
+from dateutil.parser import parse as dateparse
+import os
+
+@app.errorhandler(UnauthorizedError)
+def unauthorized(error):
+    return jsonify_status({'error': error.message}, 401)
 
 @app.route('/test')
 def test():
@@ -17,3 +28,68 @@ def test():
     '''
     return jsonify(msg='test successful')
 
+@app.route('/admin/flush_cache', methods=['POST'])
+def flush_cache():
+    '''
+    Empties the catalog cache of this process and the shared response cache.
+    Other processes see the flush within CATALOG_VERSION_CHECK_INTERVAL
+    seconds.  Should be called after REFRESH MATERIALIZED VIEW cbibs.v_elevations or
+    after deploying a buoy.  Requires the api_key as a query string or form
+    parameter.
+    '''
+    if request.values.get('api_key') != app.config['API_KEY']:
+        raise UnauthorizedError('Incorrect API key, or API key not supplied')
+    catalog_cache.clear()
+    response_cache.clear()
+    forget_catalog_version()
+    return jsonify(msg='cache flushed')
+
+@app.route('/stats/pool')
+def pool_stats():
+    '''
+    Returns the state and counters of the database connection pool of the
+    worker process which handles the request.  Requires the api_key as a
+    query string parameter.
+    '''
+    if request.values.get('api_key') != app.config['API_KEY']:
+        raise UnauthorizedError('Incorrect API key, or API key not supplied')
+    pool = db.engine.pool
+    stats = pool.status_dict() if hasattr(pool, 'status_dict') else {}
+    return jsonify(pid=os.getpid(), pool=pool.__class__.__name__, **stats)
+
+@app.route('/export')
+def export():
+    '''
+    Streams the observations of a series within a time range as a flat file,
+    read from a server side cursor and sent with chunked transfer encoding,
+    so exports are not limited in length.  Takes the QueryData arguments
+    constellation (default CBIBS), station, measurement, beg_date and
+    end_date, plus format, csv (the default) or ndjson, and the api_key as
+    query string parameters.
+    '''
+    if request.values.get('api_key') != app.config['API_KEY']:
+        raise UnauthorizedError('Incorrect API key, or API key not supplied')
+    fmt = request.args.get('format', 'csv')
+    if fmt not in FORMATS:
+        return jsonify_status({'error': 'format must be one of %s' %
+                                        ', '.join(sorted(FORMATS))}, 400)
+    try:
+        station = request.args['station']
+        measurement = request.args['measurement']
+        beg_date = dateparse(request.args['beg_date'], ignoretz=True)
+        end_date = dateparse(request.args['end_date'], ignoretz=True)
+    except (KeyError, ValueError) as e:
+        return jsonify_status({'error': 'station, measurement, beg_date and '
+                                        'end_date are required: %s' % e}, 400)
+    series = resolve_series(request.args.get('constellation', 'CBIBS'),
+                            station, measurement)
+    if series is None:
+        return jsonify_status({'error': 'No such series'}, 404)
+    batches = stream_series(series, beg_date.isoformat() + 'Z',
+                            end_date.isoformat() + 'Z',
+                            app.config.get('STREAMING_BATCH_SIZE', 5000))
+    encode, mimetype = FORMATS[fmt]
+    response = Response(stream_with_context(encode(batches)), mimetype=mimetype)
+    response.headers['Content-Disposition'] = (
+        'attachment; filename="%s_%s.%s"' % (station, measurement, fmt))
+    return compress_response(response)
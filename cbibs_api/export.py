@@ -0,0 +1,66 @@
+#!/usr/bin/env python
+#-*- coding: utf-8 -*-
+'''
+cbibs_api.export
+~~~~~~~~~~~~~~~~
+
+Flat file encodings of a series for /export.  Each encoder generates the
+file chunk by chunk from batches of QueryData rows, so an export of any
+length is written with constant memory.
+
+Copyright 2015 RPS ASA
+See LICENSE.txt
+'''
+
+from cbibs_api.serializers import format_times
+from cStringIO import StringIO
+from itertools import izip
+import csv
+import json
+
+EXPORT_COLUMNS = ['time', 'measurement', 'value', 'units']
+
+def batch_columns(rows):
+    '''
+    Returns the EXPORT_COLUMNS of a batch of QueryData rows as lists
+    '''
+    return (format_times([row['measure_ts'] for row in rows]),
+            [row['measurement'] for row in rows],
+            [float(row['obs_value']) for row in rows],
+            [row['units'] for row in rows])
+
+def _utf8(values):
+    return [v.encode('utf-8') if isinstance(v, unicode) else v for v in values]
+
+def export_csv(batches):
+    '''
+    Generates a CSV file with a header row, one chunk per batch
+    '''
+    buf = StringIO()
+    writer = csv.writer(buf)
+    writer.writerow(EXPORT_COLUMNS)
+    yield buf.getvalue()
+    for rows in batches:
+        buf = StringIO()
+        writer = csv.writer(buf)
+        times, measurements, values, units = batch_columns(rows)
+        # repr keeps every digit, str rounds to 12
+        writer.writerows(izip(times, _utf8(measurements), map(repr, values),
+                              _utf8(units)))
+        yield buf.getvalue()
+
+def export_ndjson(batches):
+    '''
+    Generates newline delimited JSON, one object per row and one chunk per
+    batch
+    '''
+    encode = json.JSONEncoder().encode
+    for rows in batches:
+        yield ''.join(encode(dict(izip(EXPORT_COLUMNS, row))) + '\n'
+                      for row in izip(*batch_columns(rows)))
+
+# format parameter to (encoder, mimetype)
+FORMATS = {
+    'csv': (export_csv, 'text/csv'),
+    'ndjson': (export_ndjson, 'application/x-ndjson')
+}
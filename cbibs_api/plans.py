@@ -0,0 +1,88 @@
+#!/usr/bin/env python
+#-*- coding: utf-8 -*-
+'''
+cbibs_api.plans
+~~~~~~~~~~~~~~~
+
+Checks the query plans of the stored SQL for sequential scans of the fact
+table.  Each query is EXPLAINed with sequential scans disabled, so a sequential
+scan left in a plan means there is no index the query can use.
+
+    python -m cbibs_api.plans
+
+Copyright 2015 RPS ASA
+See LICENSE.txt
+'''
+
+from cbibs_api.queries import SQL
+import json
+
+FACT_TABLE = 'f_observation'
+
+# migrations, and stored queries which are not served by the API
+SKIP = ('Create', 'Test', 'GetLastMeasurementTime', 'ListStations')
+
+# bound to every query, each query uses the names it needs
+SAMPLE_PARAMS = {
+    'constellation': 'CBIBS',
+    'station': 'J',
+    'measurement': 'sea_water_temperature',
+    'parameter': 'sea_water_temperature',
+    'superset': 'WQJ',
+    'beg_date': '2015-10-01',
+    'end_date': '2015-10-02',
+    'start_date': '2015-10-01',
+    'stations': ['J'],
+    'measurements': ['sea_water_temperature'],
+    'station_id': 1,
+    'station_ids': [1],
+    'variable_ids': [1],
+    'location_ids': [1],
+    'blacklist': ['error_count'],
+    'interval': 'day',
+    'width': None,
+    'origin': 0
+}
+
+def sequential_scans(plan, relation=FACT_TABLE):
+    '''
+    Returns the Seq Scan nodes on relation in an EXPLAIN (FORMAT JSON) plan
+    '''
+    nodes = []
+    if plan.get('Node Type') == 'Seq Scan' and plan.get('Relation Name') == relation:
+        nodes.append(plan)
+    for child in plan.get('Plans', []):
+        nodes.extend(sequential_scans(child, relation))
+    return nodes
+
+def check_plans(connection, params=SAMPLE_PARAMS):
+    '''
+    EXPLAINs every stored query and returns a dict of the names of the
+    queries which sequentially scan the fact table to the offending plan nodes
+    :param connection: SQLAlchemy connection to the database to check against
+    :param params: parameters bound to every query
+    '''
+    failures = {}
+    connection.execute('SET enable_seqscan = off')
+    try:
+        for name in sorted(SQL):
+            if name.startswith(SKIP):
+                continue
+            result = connection.execute('EXPLAIN (FORMAT JSON) ' + SQL[name],
+                                        params).scalar()
+            if isinstance(result, basestring):
+                result = json.loads(result)
+            scans = sequential_scans(result[0]['Plan'])
+            if scans:
+                failures[name] = scans
+    finally:
+        connection.execute('RESET enable_seqscan')
+    return failures
+
+if __name__ == '__main__':
+    from cbibs_api import db
+    with db.engine.connect() as connection:
+        failures = check_plans(connection)
+    for name in sorted(failures):
+        print '%s: sequential scan of %s' % (name, FACT_TABLE)
+    raise SystemExit(1 if failures else 0)
@@ -0,0 +1,111 @@
+#!/usr/bin/env python
+#-*- coding: utf-8 -*-
+'''
+cbibs_api.pool
+~~~~~~~~~~~~~~
+
+Database connection pool instrumentation.  InstrumentedQueuePool records how
+long checkouts wait for a connection and how often the pool overflows or
+times out, published per process on /stats/pool.
+
+Copyright 2015 RPS ASA
+See LICENSE.txt
+'''
+
+from sqlalchemy import exc
+from sqlalchemy.pool import QueuePool
+from threading import Lock
+import time
+
+class PoolStats(object):
+    '''
+    Counters of a connection pool, updated from any thread
+    '''
+    def __init__(self):
+        self._lock = Lock()
+        self.checkouts = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+        self.timeouts = 0
+        self.overflows = 0
+        self.disconnects = 0
+
+    def record_wait(self, seconds):
+        with self._lock:
+            self.checkouts += 1
+            self.wait_total += seconds
+            self.wait_max = max(self.wait_max, seconds)
+
+    def increment(self, name):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + 1)
+
+    def as_dict(self):
+        with self._lock:
+            return {
+                'checkouts': self.checkouts,
+                'wait_total': self.wait_total,
+                'wait_mean': self.wait_total / self.checkouts if self.checkouts else 0.0,
+                'wait_max': self.wait_max,
+                'timeouts': self.timeouts,
+                'overflows': self.overflows,
+                'disconnects': self.disconnects
+            }
+
+class InstrumentedQueuePool(QueuePool):
+    '''
+    QueuePool keeping PoolStats.  Relies on the _do_get and _inc_overflow
+    hooks of the pinned SQLAlchemy 1.0 QueuePool.
+    '''
+    def __init__(self, *args, **kwargs):
+        QueuePool.__init__(self, *args, **kwargs)
+        self.stats = PoolStats()
+
+    def _do_get(self):
+        start = time.time()
+        try:
+            return QueuePool._do_get(self)
+        except exc.TimeoutError:
+            self.stats.increment('timeouts')
+            raise
+        finally:
+            self.stats.record_wait(time.time() - start)
+
+    def _inc_overflow(self):
+        incremented = QueuePool._inc_overflow(self)
+        # _overflow counts up from -pool_size, positive once past pool_size
+        if incremented and self._overflow > 0:
+            self.stats.increment('overflows')
+        return incremented
+
+    def status_dict(self):
+        '''
+        Returns the current state of the pool along with its stats
+        '''
+        status = {
+            'size': self.size(),
+            'checked_in': self.checkedin(),
+            'checked_out': self.checkedout(),
+            'overflow': self.overflow(),
+            'max_overflow': self._max_overflow,
+            'timeout': self._timeout
+        }
+        status.update(self.stats.as_dict())
+        return status
+
+def ping_connection(dbapi_connection, connection_record, connection_proxy):
+    '''
+    Pool checkout listener which tests the connection first, so connections
+    left stale by a database restart are replaced instead of failing the
+    request
+    '''
+    cursor = dbapi_connection.cursor()
+    try:
+        cursor.execute('SELECT 1')
+    except Exception:
+        pool = connection_proxy._pool
+        if isinstance(pool, InstrumentedQueuePool):
+            pool.stats.increment('disconnects')
+        # the pool retries the checkout with a new connection
+        raise exc.DisconnectionError()
+    cursor.close()
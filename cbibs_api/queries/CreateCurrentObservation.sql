@@ -0,0 +1,174 @@
+-- CreateCurrentObservation
+-- Maintains the latest good (non-null, QC code not 3 or 4) observation of every
+-- station/variable/elevation in cbibs.current_observation.  The table is kept
+-- up to date by a trigger on cbibs.f_observation and can be rebuilt with
+--     SELECT cbibs.refresh_current_observation();
+-- or for a single station with
+--     SELECT cbibs.refresh_current_observation(<d_station_id>);
+
+DROP TRIGGER IF EXISTS f_observation_current ON cbibs.f_observation;
+DROP TABLE IF EXISTS cbibs.current_observation;
+
+CREATE TABLE cbibs.current_observation (
+    d_station_id INT NOT NULL REFERENCES cbibs.d_station,
+    d_variable_id INT NOT NULL REFERENCES cbibs.d_variable,
+    elevation DOUBLE PRECISION NOT NULL,
+    d_location_id INT NOT NULL REFERENCES cbibs.d_location,
+    d_qa_code_primary_id INT NOT NULL REFERENCES cbibs.d_qa_code_primary,
+    measure_ts TIMESTAMP WITH TIME ZONE NOT NULL,
+    obs_value DOUBLE PRECISION NOT NULL,
+    PRIMARY KEY (d_station_id, d_variable_id, elevation)
+);
+
+CREATE OR REPLACE FUNCTION cbibs.refresh_current_observation(station_id INT DEFAULT NULL) RETURNS void AS $$
+BEGIN
+    DELETE FROM cbibs.current_observation c
+    WHERE station_id IS NULL OR c.d_station_id = station_id;
+
+    INSERT INTO cbibs.current_observation
+    SELECT
+        DISTINCT ON (o.d_station_id, o.d_variable_id, l.elevation)
+        o.d_station_id,
+        o.d_variable_id,
+        l.elevation,
+        o.d_location_id,
+        o.d_qa_code_primary_id,
+        o.measure_ts,
+        o.obs_value
+    FROM cbibs.f_observation o
+    JOIN cbibs.d_location l ON l.id = o.d_location_id
+    JOIN cbibs.d_qa_code_primary qc ON qc.id = o.d_qa_code_primary_id
+    WHERE
+        (station_id IS NULL OR o.d_station_id = station_id)
+        AND o.obs_value IS NOT NULL
+        AND qc.qa_code NOT IN (3, 4)
+    ORDER BY o.d_station_id, o.d_variable_id, l.elevation, o.measure_ts DESC;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Recomputes the current observation of a single station/variable/elevation
+CREATE OR REPLACE FUNCTION cbibs.refresh_current_series(station_id INT, variable_id INT, series_elevation DOUBLE PRECISION) RETURNS void AS $$
+BEGIN
+    DELETE FROM cbibs.current_observation c
+    WHERE
+        c.d_station_id = station_id
+        AND c.d_variable_id = variable_id
+        AND c.elevation = series_elevation;
+
+    INSERT INTO cbibs.current_observation
+    SELECT
+        o.d_station_id,
+        o.d_variable_id,
+        l.elevation,
+        o.d_location_id,
+        o.d_qa_code_primary_id,
+        o.measure_ts,
+        o.obs_value
+    FROM cbibs.f_observation o
+    JOIN cbibs.d_location l ON l.id = o.d_location_id
+    JOIN cbibs.d_qa_code_primary qc ON qc.id = o.d_qa_code_primary_id
+    WHERE
+        o.d_station_id = station_id
+        AND o.d_variable_id = variable_id
+        AND l.elevation = series_elevation
+        AND o.obs_value IS NOT NULL
+        AND qc.qa_code NOT IN (3, 4)
+    ORDER BY o.measure_ts DESC
+    LIMIT 1;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION cbibs.update_current_observation() RETURNS trigger AS $$
+DECLARE
+    obs_elevation DOUBLE PRECISION;
+    old_elevation DOUBLE PRECISION;
+BEGIN
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        -- only a change to the current observation of a series can make the
+        -- stored row stale, recompute that series alone
+        SELECT l.elevation INTO old_elevation
+        FROM cbibs.d_location l
+        WHERE l.id = OLD.d_location_id;
+
+        IF EXISTS (
+            SELECT 1 FROM cbibs.current_observation c
+            WHERE
+                c.d_station_id = OLD.d_station_id
+                AND c.d_variable_id = OLD.d_variable_id
+                AND c.elevation = old_elevation
+                AND c.d_location_id = OLD.d_location_id
+                AND c.measure_ts = OLD.measure_ts
+        ) THEN
+            PERFORM cbibs.refresh_current_series(OLD.d_station_id,
+                                                 OLD.d_variable_id,
+                                                 old_elevation);
+        END IF;
+
+        IF TG_OP = 'DELETE' THEN
+            RETURN NULL;
+        END IF;
+    END IF;
+
+    IF NEW.obs_value IS NULL OR NOT EXISTS (
+        SELECT 1 FROM cbibs.d_qa_code_primary qc
+        WHERE qc.id = NEW.d_qa_code_primary_id AND qc.qa_code NOT IN (3, 4)
+    ) THEN
+        RETURN NULL;
+    END IF;
+
+    SELECT l.elevation INTO obs_elevation
+    FROM cbibs.d_location l
+    WHERE l.id = NEW.d_location_id;
+
+    UPDATE cbibs.current_observation c SET
+        d_location_id = NEW.d_location_id,
+        d_qa_code_primary_id = NEW.d_qa_code_primary_id,
+        measure_ts = NEW.measure_ts,
+        obs_value = NEW.obs_value
+    WHERE
+        c.d_station_id = NEW.d_station_id
+        AND c.d_variable_id = NEW.d_variable_id
+        AND c.elevation = obs_elevation
+        AND c.measure_ts <= NEW.measure_ts;
+
+    IF NOT FOUND THEN
+        BEGIN
+            INSERT INTO cbibs.current_observation
+            SELECT
+                NEW.d_station_id,
+                NEW.d_variable_id,
+                obs_elevation,
+                NEW.d_location_id,
+                NEW.d_qa_code_primary_id,
+                NEW.measure_ts,
+                NEW.obs_value
+            WHERE NOT EXISTS (
+                SELECT 1 FROM cbibs.current_observation c
+                WHERE
+                    c.d_station_id = NEW.d_station_id
+                    AND c.d_variable_id = NEW.d_variable_id
+                    AND c.elevation = obs_elevation
+            );
+        EXCEPTION WHEN unique_violation THEN
+            -- a concurrent ingest inserted the series first, keep the newer row
+            UPDATE cbibs.current_observation c SET
+                d_location_id = NEW.d_location_id,
+                d_qa_code_primary_id = NEW.d_qa_code_primary_id,
+                measure_ts = NEW.measure_ts,
+                obs_value = NEW.obs_value
+            WHERE
+                c.d_station_id = NEW.d_station_id
+                AND c.d_variable_id = NEW.d_variable_id
+                AND c.elevation = obs_elevation
+                AND c.measure_ts <= NEW.measure_ts;
+        END;
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER f_observation_current
+    AFTER INSERT OR UPDATE OR DELETE ON cbibs.f_observation
+    FOR EACH ROW EXECUTE PROCEDURE cbibs.update_current_observation();
+
+SELECT cbibs.refresh_current_observation();
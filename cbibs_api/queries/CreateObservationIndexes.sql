@@ -0,0 +1,15 @@
+-- CreateObservationIndexes
+-- Indexes used by the range predicates of the stored queries.  Built
+-- concurrently so ingest into cbibs.f_observation is not blocked, run this
+-- outside of a transaction block.
+
+DROP INDEX IF EXISTS cbibs.f_observation_series_ts_idx;
+CREATE INDEX CONCURRENTLY f_observation_series_ts_idx
+    ON cbibs.f_observation (d_station_id, d_variable_id, d_location_id, measure_ts);
+
+DROP INDEX IF EXISTS cbibs.d_provider_upper_organization_idx;
+CREATE INDEX d_provider_upper_organization_idx
+    ON cbibs.d_provider (UPPER(organization));
+
+ANALYZE cbibs.f_observation;
+ANALYZE cbibs.d_provider;
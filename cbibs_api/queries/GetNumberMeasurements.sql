@@ -6,4 +6,5 @@ JOIN cbibs.d_provider pr ON pr.id = st.d_provider_id
 WHERE st.description = %(station)s 
     AND v.actual_name = %(measurement)s
     AND UPPER(pr.organization) = UPPER(%(constellation)s)
-    AND measure_ts AT TIME ZONE 'UTC' > %(beg_date)s AND  measure_ts AT TIME ZONE 'UTC' < %(end_date)s;
+    AND o.measure_ts > (%(beg_date)s::timestamp AT TIME ZONE 'UTC')
+    AND o.measure_ts < (%(end_date)s::timestamp AT TIME ZONE 'UTC');
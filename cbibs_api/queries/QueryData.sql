@@ -1,5 +1,7 @@
+-- QueryData
+-- Observations for a single series resolved by ResolveSeries
 SELECT
-    DISTINCT ON (o.measure_ts, measurement, l.elevation)
+    DISTINCT ON (o.measure_ts, l.elevation)
     o.measure_ts AT TIME ZONE 'UTC' as measure_ts,
     cbibs.depth_naming(v.actual_name, l.elevation) as measurement,
     v.report_name,
@@ -7,15 +9,17 @@ SELECT
     u.canonical_units as units,
     qc.qa_code as primary_qc
 FROM cbibs.f_observation o
-JOIN cbibs.d_variable v ON v.id=o.d_variable_id
+JOIN cbibs.d_variable v ON v.id = o.d_variable_id
 JOIN cbibs.d_units u ON u.id = v.d_units_id
 JOIN cbibs.d_location l ON l.id = o.d_location_id
-JOIN cbibs.d_station s ON s.id = o.d_station_id
-JOIN cbibs.d_provider pr ON pr.id = s.d_provider_id
 JOIN cbibs.d_qa_code_primary qc ON qc.id = o.d_qa_code_primary_id
 WHERE
-    s.description = %(station)s
+    o.d_station_id = %(station_id)s
+    AND o.d_variable_id = ANY(%(variable_ids)s)
+    AND o.d_location_id = ANY(%(location_ids)s)
     AND o.measure_ts > %(beg_date)s
     AND o.measure_ts < %(end_date)s
-    AND UPPER(pr.organization) = UPPER(%(constellation)s);
-
+    AND cbibs.depth_naming(v.actual_name, l.elevation) = %(measurement)s
+    AND o.obs_value IS NOT NULL
+    AND qc.qa_code NOT IN (3, 4)
+ORDER BY o.measure_ts, l.elevation;
@@ -0,0 +1,41 @@
+-- QueryDataAggregated
+-- Minimum, mean and maximum of a single series resolved by ResolveSeries per
+-- time bucket.  Buckets are calendar periods (date_trunc) when interval is
+-- set, otherwise fixed widths of width seconds starting at origin (seconds
+-- since the epoch)
+SELECT
+    CASE WHEN %(interval)s IS NULL
+        THEN to_timestamp(%(origin)s + floor((extract(epoch FROM o.measure_ts) - %(origin)s) / %(width)s) * %(width)s) AT TIME ZONE 'UTC'
+        ELSE date_trunc(%(interval)s, o.measure_ts AT TIME ZONE 'UTC')
+    END AS bucket,
+    o.report_name,
+    o.units,
+    MIN(o.obs_value) AS min,
+    AVG(o.obs_value) AS mean,
+    MAX(o.obs_value) AS max,
+    COUNT(*) AS count
+FROM (
+    SELECT
+        DISTINCT ON (o.measure_ts, l.elevation)
+        o.measure_ts,
+        o.obs_value,
+        v.report_name,
+        u.canonical_units as units
+    FROM cbibs.f_observation o
+    JOIN cbibs.d_variable v ON v.id = o.d_variable_id
+    JOIN cbibs.d_units u ON u.id = v.d_units_id
+    JOIN cbibs.d_location l ON l.id = o.d_location_id
+    JOIN cbibs.d_qa_code_primary qc ON qc.id = o.d_qa_code_primary_id
+    WHERE
+        o.d_station_id = %(station_id)s
+        AND o.d_variable_id = ANY(%(variable_ids)s)
+        AND o.d_location_id = ANY(%(location_ids)s)
+        AND o.measure_ts > %(beg_date)s
+        AND o.measure_ts < %(end_date)s
+        AND cbibs.depth_naming(v.actual_name, l.elevation) = %(measurement)s
+        AND o.obs_value IS NOT NULL
+        AND qc.qa_code NOT IN (3, 4)
+    ORDER BY o.measure_ts, l.elevation
+) o
+GROUP BY bucket, o.report_name, o.units
+ORDER BY bucket;
@@ -0,0 +1,28 @@
+-- QueryDataMulti
+-- Observations for several series resolved by ResolveSeries, covering every
+-- combination of the stations and measurements
+SELECT
+    DISTINCT ON (s.description, measurement, o.measure_ts, l.elevation)
+    s.description as station,
+    o.measure_ts AT TIME ZONE 'UTC' as measure_ts,
+    cbibs.depth_naming(v.actual_name, l.elevation) as measurement,
+    v.report_name,
+    o.obs_value,
+    u.canonical_units as units,
+    qc.qa_code as primary_qc
+FROM cbibs.f_observation o
+JOIN cbibs.d_station s ON s.id = o.d_station_id
+JOIN cbibs.d_variable v ON v.id = o.d_variable_id
+JOIN cbibs.d_units u ON u.id = v.d_units_id
+JOIN cbibs.d_location l ON l.id = o.d_location_id
+JOIN cbibs.d_qa_code_primary qc ON qc.id = o.d_qa_code_primary_id
+WHERE
+    o.d_station_id = ANY(%(station_ids)s)
+    AND o.d_variable_id = ANY(%(variable_ids)s)
+    AND o.d_location_id = ANY(%(location_ids)s)
+    AND o.measure_ts > %(beg_date)s
+    AND o.measure_ts < %(end_date)s
+    AND cbibs.depth_naming(v.actual_name, l.elevation) = ANY(%(measurements)s)
+    AND o.obs_value IS NOT NULL
+    AND qc.qa_code NOT IN (3, 4)
+ORDER BY s.description, measurement, o.measure_ts, l.elevation;
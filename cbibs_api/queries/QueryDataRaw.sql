@@ -1,6 +1,8 @@
 SELECT
     DISTINCT ON (o.measure_ts, v.actual_name, l.elevation)
     to_char(measure_ts AT TIME ZONE 'UTC', 'YYYY-MM-DD HH24:MI:SS') as time,
+    -- the same time as a timestamp, for columnar results
+    measure_ts AT TIME ZONE 'UTC' as measure_ts,
     obs_value as value,
     cbibs.depth_naming(v.actual_name, l.elevation) as measurement,
     v.report_name,
@@ -13,8 +15,8 @@ JOIN cbibs.d_units u ON u.id = v.d_units_id
 JOIN cbibs.d_provider pr ON pr.id = s.d_provider_id
 JOIN cbibs.d_qa_code_primary qc ON qc.id = o.d_qa_code_primary_id
 WHERE 
-    measure_ts AT TIME ZONE 'UTC' > %(beg_date)s
-    AND measure_ts AT TIME ZONE 'UTC' < %(end_date)s
+    o.measure_ts > (%(beg_date)s::timestamp AT TIME ZONE 'UTC')
+    AND o.measure_ts < (%(end_date)s::timestamp AT TIME ZONE 'UTC')
     AND s.description = %(station)s
     AND UPPER(pr.organization) = UPPER(%(constellation)s)
     AND v.actual_name = %(measurement)s;
@@ -0,0 +1,34 @@
+-- ResolveSeries
+-- Resolves depth named measurements (see cbibs.depth_naming) at stations to
+-- the station, variable and location ids used by cbibs.f_observation.  Every
+-- combination of stations and measurements is resolved.  Only the locations
+-- a station has observations at are considered, found with the
+-- f_observation_series_ts_idx index, and the CTE keeps cbibs.depth_naming
+-- from being evaluated for any other location.
+WITH station_locations AS (
+    SELECT
+        s.description AS station,
+        m.measurement,
+        s.id AS station_id,
+        v.id AS variable_id,
+        v.actual_name,
+        l.id AS location_id,
+        l.elevation
+    FROM cbibs.d_station s
+    JOIN cbibs.d_provider pr ON pr.id = s.d_provider_id
+    CROSS JOIN unnest(%(measurements)s::text[]) AS m(measurement)
+    JOIN cbibs.d_variable v ON v.actual_name IN (m.measurement, regexp_replace(m.measurement, '_bottom$', ''))
+    JOIN cbibs.d_location l ON EXISTS (
+        SELECT 1
+        FROM cbibs.f_observation o
+        WHERE o.d_station_id = s.id
+            AND o.d_variable_id = v.id
+            AND o.d_location_id = l.id
+    )
+    WHERE
+        s.description = ANY(%(stations)s)
+        AND UPPER(pr.organization) = UPPER(%(constellation)s)
+)
+SELECT station, measurement, station_id, variable_id, location_id
+FROM station_locations
+WHERE cbibs.depth_naming(actual_name, elevation) = measurement;
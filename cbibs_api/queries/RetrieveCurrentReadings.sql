@@ -1,20 +1,45 @@
-SELECT
-    DISTINCT ON (o.measure_ts, measurement, l.elevation)
-    o.measure_ts AT TIME ZONE 'UTC' as measure_ts,
-    cbibs.depth_naming(v.actual_name, l.elevation) as measurement,
-    v.report_name,
-    o.obs_value,
-    u.canonical_units,
-    qc.qa_code as primary_qc
-FROM cbibs.f_observation o
-JOIN cbibs.d_variable v ON v.id=o.d_variable_id
-JOIN cbibs.d_units u ON u.id = v.d_units_id
-JOIN cbibs.d_location l ON l.id = o.d_location_id
-JOIN cbibs.d_station s ON s.id = o.d_station_id
-JOIN cbibs.d_provider pr ON pr.id = s.d_provider_id
-JOIN cbibs.d_qa_code_primary qc ON qc.id = o.d_qa_code_primary_id
-WHERE
-    s.description = %(station)s
-    AND o.measure_ts > %(start_date)s
-    AND UPPER(pr.organization) = UPPER(%(constellation)s);
-
+-- RetrieveCurrentReadings
+-- The latest good observation of each measurement reported by a station, read
+-- from the table maintained by CreateCurrentObservation.sql.  Readings are
+-- listed in the order the measurements first reported a good observation
+-- after start_date, then by measurement, as clients indexing the arrays by
+-- position expect.  That observation is found on the f_observation_series_ts_idx
+-- index of the series of each reading.
+SELECT measure_ts, measurement, report_name, obs_value, canonical_units
+FROM (
+    SELECT
+        DISTINCT ON (measurement)
+        c.measure_ts AT TIME ZONE 'UTC' as measure_ts,
+        cbibs.depth_naming(v.actual_name, c.elevation) as measurement,
+        v.report_name,
+        c.obs_value,
+        u.canonical_units,
+        c.d_station_id,
+        c.d_variable_id,
+        c.d_location_id
+    FROM cbibs.current_observation c
+    JOIN cbibs.d_variable v ON v.id = c.d_variable_id
+    JOIN cbibs.d_units u ON u.id = v.d_units_id
+    JOIN cbibs.d_station s ON s.id = c.d_station_id
+    JOIN cbibs.d_provider pr ON pr.id = s.d_provider_id
+    WHERE
+        s.description = %(station)s
+        AND c.measure_ts > %(start_date)s
+        AND UPPER(pr.organization) = UPPER(%(constellation)s)
+        AND cbibs.depth_naming(v.actual_name, c.elevation) <> ALL(%(blacklist)s)
+    ORDER BY measurement, c.measure_ts DESC
+) latest
+ORDER BY (
+    SELECT o.measure_ts
+    FROM cbibs.f_observation o
+    JOIN cbibs.d_qa_code_primary qc ON qc.id = o.d_qa_code_primary_id
+    WHERE
+        o.d_station_id = latest.d_station_id
+        AND o.d_variable_id = latest.d_variable_id
+        AND o.d_location_id = latest.d_location_id
+        AND o.measure_ts > %(start_date)s
+        AND o.obs_value IS NOT NULL
+        AND qc.qa_code NOT IN (3, 4)
+    ORDER BY o.measure_ts
+    LIMIT 1
+), measurement;
@@ -15,9 +15,60 @@
 '''
 
 import pkg_resources
+import re
 
 SQL = {}
 
+# psycopg2 pyformat placeholders, %(name)s
+PLACEHOLDER = re.compile(r'%\(([A-Za-z_][A-Za-z0-9_]*)\)s')
+
+class Statement(str):
+    '''
+    A stored query.  Behaves as the query text, and also holds the names of
+    its bind parameters in order of first use and the PREPARE and EXECUTE
+    statements which run it as a server side prepared statement.
+    '''
+    def __new__(cls, text, name):
+        statement = str.__new__(cls, text)
+        statement.name = name
+        statement.params = tuple(_unique(PLACEHOLDER.findall(text)))
+        statement.prepared_name = 'cbibs_' + name.lower()
+        statement.preparable = _is_single_query(text)
+        return statement
+
+    @property
+    def prepare_sql(self):
+        '''
+        PREPARE statement for this query, the parameter types are inferred
+        by the server.  Run without bind parameters.
+        '''
+        positions = dict((name, i + 1) for i, name in enumerate(self.params))
+        body = PLACEHOLDER.sub(lambda m: '$%d' % positions[m.group(1)],
+                               self.strip().rstrip(';'))
+        return 'PREPARE %s AS %s' % (self.prepared_name, body.replace('%%', '%'))
+
+    @property
+    def execute_sql(self):
+        '''
+        EXECUTE statement for this query, taking the same bind parameters
+        '''
+        if not self.params:
+            return 'EXECUTE %s' % self.prepared_name
+        return 'EXECUTE %s(%s)' % (self.prepared_name,
+                                   ', '.join('%%(%s)s' % name for name in self.params))
+
+def _unique(names):
+    seen = set()
+    for name in names:
+        if name not in seen:
+            seen.add(name)
+            yield name
+
+def _is_single_query(text):
+    body = text.strip().rstrip(';')
+    return (body.split(None, 1)[0].upper() in ('SELECT', 'WITH') and
+            ';' not in body)
+
 def load():
     '''
     Loads each of the .sql files and places the query into the SQL variable
@@ -26,9 +77,8 @@ def load():
     for resource in pkg_resources.resource_listdir(__name__, None):
         if resource.endswith('sql'):
             buf = pkg_resources.resource_string(__name__, resource)
-            sql = parse_sql(buf)
             name = resource.replace('.sql','')
-            SQL[name] = sql
+            SQL[name] = Statement(parse_sql(buf), name)
 
 def parse_sql(buf):
     output = []
@@ -40,7 +90,3 @@ def parse_sql(buf):
 
 if len(SQL) == 0:
     load()
-
-
-
-
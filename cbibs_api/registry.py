@@ -0,0 +1,87 @@
+#!/usr/bin/env python
+#-*- coding: utf-8 -*-
+'''
+cbibs_api.registry
+~~~~~~~~~~~~~~~~~~
+
+The RPC method registry.  Each resource registers its public name once with
+the register decorator, which compiles a Method holding everything the
+dispatcher and the system.* introspection methods need, so no reflection is
+done while handling a request.
+
+Copyright 2015 RPS ASA
+See LICENSE.txt
+'''
+
+from cbibs_api.utils import check_api_key_and_req_type, BINARY_MEDIATYPES
+
+# legacy namespaces the CDRH clients prefix method names with
+XMLRPC_NAMESPACE = 'xmlrpc_cdrh'
+JSONRPC_NAMESPACE = 'jsonrpc_cdrh'
+BOTH_NAMESPACES = (XMLRPC_NAMESPACE, JSONRPC_NAMESPACE)
+
+PROTOCOLS = ('XML-RPC', 'JSON-RPC')
+
+# media types every method's result is encoded in
+TEXT_MEDIATYPES = ('text/xml', 'application/json')
+
+# every public method name and alias to its Method
+methods = {}
+
+class Method(object):
+    '''
+    A compiled RPC method.
+    :param name: public name, without a namespace
+    :param resource: BaseResource subclass implementing the method
+    '''
+    __slots__ = ('name', 'resource', 'keys', 'optional_keys', 'decorators',
+                 'requires_key', 'streams', 'columnar', 'return_type',
+                 'signature', 'help', 'producers')
+
+    def __init__(self, name, resource):
+        self.name = name
+        self.resource = resource
+        self.keys = tuple(resource.keys or ())
+        self.optional_keys = tuple(getattr(resource, 'optional_keys', ()))
+        self.decorators = tuple(getattr(resource, 'method_decorators', ()))
+        self.requires_key = check_api_key_and_req_type in self.decorators
+        self.streams = hasattr(resource, 'stream')
+        self.columnar = hasattr(resource, 'columns')
+        self.return_type = resource.return_type
+        # nested lists on purpose, a method may have several signatures
+        self.signature = [[self.return_type] + ['string'] * (len(self.keys) + i)
+                          for i in range(len(self.optional_keys) + 1)]
+        self.help = dict((protocol, resource.get_description(protocol))
+                         for protocol in PROTOCOLS)
+        # the response schema, each media type the result can be encoded in
+        # to the resource method producing the result for it
+        self.producers = dict((mediatype, 'stream' if self.streams else 'get')
+                              for mediatype in TEXT_MEDIATYPES)
+        if self.columnar:
+            self.producers.update((mediatype, 'columns')
+                                  for mediatype in BINARY_MEDIATYPES)
+
+    def bind(self, params, has_key=False):
+        '''
+        Returns the request args for the positional params of a call, which
+        end with the API key if has_key
+        '''
+        if has_key and self.optional_keys and self.requires_key:
+            # optional params come between the keys and the API key
+            params = params[:-1]
+        return dict(zip(self.keys + self.optional_keys, params))
+
+def register(name, namespaces=(XMLRPC_NAMESPACE,)):
+    '''
+    Class decorator registering a resource as the RPC method name, also
+    reachable as name prefixed with each of namespaces
+    '''
+    def decorator(resource):
+        method = Method(name, resource)
+        for alias in (name,) + tuple('%s.%s' % (namespace, name)
+                                     for namespace in namespaces):
+            if alias in methods:
+                raise ValueError('RPC method %s is already registered' % alias)
+            methods[alias] = method
+        return resource
+    return decorator
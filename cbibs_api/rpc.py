@@ -0,0 +1,95 @@
+#!/usr/bin/env python
+#-*- coding: utf-8 -*-
+'''
+cbibs_api.rpc
+~~~~~~~~~~~~~
+
+Decoding of legacy XML-RPC and JSON-RPC request bodies.  The body is decoded
+once per request into an RpcCall, which is shared by the API key check and
+the dispatcher.
+
+Copyright 2015 RPS ASA
+See LICENSE.txt
+'''
+
+from cbibs_api import app
+from cbibs_api.cache import TTLCache, MISSING
+from flask import request
+from collections import namedtuple
+from defusedxml.xmlrpc import xmlrpc_client
+from werkzeug.exceptions import BadRequest, RequestEntityTooLarge
+import json
+
+# bodies of at most MEMO_BODY_BYTES are memoized, most polling clients send
+# the same few calls over and over
+MEMO_BODY_BYTES = 2048
+_memo = TTLCache(app.config.get('RPC_MEMO_SIZE', 256))
+
+class RpcCall(namedtuple('RpcCall', ['method', 'params', 'protocol', 'id'])):
+    '''
+    A decoded RPC call.  params is the tuple of positional parameters as
+    sent, ending with the API key for methods which require one.
+    '''
+    __slots__ = ()
+
+    @property
+    def api_key(self):
+        return self.params[-1] if self.params else None
+
+def is_xml(content_type):
+    return 'xml' in (content_type or '')
+
+def parse_call(body, content_type):
+    '''
+    Returns the RpcCall encoded in body, or a tuple of RpcCalls for a JSON-RPC
+    batch.  Raises BadRequest if the body can not be decoded.
+    '''
+    if is_xml(content_type):
+        try:
+            params, method = xmlrpc_client.loads(body)
+        except Exception as e:
+            raise BadRequest('Invalid XML-RPC request: %s' % e)
+        return RpcCall(method, tuple(params), 'xmlrpc', None)
+    try:
+        payload = json.loads(body)
+    except ValueError as e:
+        raise BadRequest('Invalid JSON-RPC request: %s' % e)
+    if isinstance(payload, list):
+        return tuple(json_call(item) for item in payload)
+    return json_call(payload)
+
+def json_call(payload):
+    if not isinstance(payload, dict):
+        return RpcCall(None, (), 'jsonrpc', None)
+    params = payload.get('params', [])
+    if not isinstance(params, list):
+        raise BadRequest('JSON-RPC params must be an array')
+    return RpcCall(payload.get('method'), tuple(params), 'jsonrpc',
+                   payload.get('id'))
+
+def decode_call():
+    '''
+    Returns the RpcCall for the current request, decoding the body on first
+    use.  Bodies larger than MAX_RPC_BODY_BYTES are rejected before they are
+    read.
+    '''
+    # kept on the request, g outlives it when the app context is shared
+    call = getattr(request, 'rpc_call', None)
+    if call is not None:
+        return call
+    max_bytes = app.config.get('MAX_RPC_BODY_BYTES', 1024 * 1024)
+    if request.content_length > max_bytes:
+        raise RequestEntityTooLarge()
+    body = request.stream.read(max_bytes + 1)
+    if len(body) > max_bytes:
+        raise RequestEntityTooLarge()
+    if len(body) <= MEMO_BODY_BYTES:
+        key = (is_xml(request.content_type), body)
+        call = _memo.get(key)
+        if call is MISSING:
+            call = parse_call(body, request.content_type)
+            _memo.set(key, call, app.config.get('RPC_MEMO_TTL', 3600))
+    else:
+        call = parse_call(body, request.content_type)
+    request.rpc_call = call
+    return call
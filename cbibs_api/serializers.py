@@ -0,0 +1,103 @@
+#!/usr/bin/env python
+#-*- coding: utf-8 -*-
+'''
+cbibs_api.serializers
+~~~~~~~~~~~~~~~~~~~~~
+
+JSON serializers for RPC responses.  Besides the types the json module
+handles, results may hold NumPy arrays and scalars, datetime64 values,
+datetimes and Decimals.  Timestamps are encoded as 'YYYY-MM-DD HH:MM:SS'
+strings, the format every method returns.
+
+The json backend (the default) produces exactly the output of json.dumps.
+The simplejson and ujson backends are used when installed and configured
+with JSON_BACKEND; ujson is considerably faster but writes floats with at
+most 15 significant digits and omits the spaces after separators.
+
+Copyright 2015 RPS ASA
+See LICENSE.txt
+'''
+
+from datetime import datetime
+from decimal import Decimal
+import json
+import numpy as np
+
+try:
+    import simplejson
+except ImportError:
+    simplejson = None
+
+try:
+    import ujson
+except ImportError:
+    ujson = None
+
+TIME_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+def format_times(values):
+    '''
+    Returns a list of 'YYYY-MM-DD HH:MM:SS' strings for a sequence of
+    datetime64 values or datetimes, formatted in bulk rather than one value at
+    a time.  Timezone aware datetimes are formatted in UTC.
+    '''
+    values = np.asarray(values, dtype='datetime64[ns]')
+    strings = np.datetime_as_string(values, unit='s').astype('S19')
+    # 'YYYY-MM-DDTHH:MM:SS', replace the T in place
+    chars = strings.view('S1').reshape(-1, 19)
+    chars[chars[:, 10] == 'T', 10] = ' '
+    return strings.tolist()
+
+def default(obj):
+    '''
+    Returns a JSON serializable equivalent of obj, for json.JSONEncoder
+    '''
+    if isinstance(obj, np.ndarray):
+        if obj.dtype.kind == 'M':
+            return format_times(obj)
+        return obj.tolist()
+    if isinstance(obj, np.datetime64):
+        return format_times([obj])[0]
+    if isinstance(obj, np.generic):
+        return obj.item()
+    if isinstance(obj, datetime):
+        return obj.strftime(TIME_FORMAT)
+    if isinstance(obj, Decimal):
+        return float(obj)
+    raise TypeError('%r is not JSON serializable' % (obj,))
+
+_special = (np.ndarray, np.generic, datetime, Decimal)
+
+def prepare(obj):
+    '''
+    Returns obj with every value default handles replaced, for encoders
+    which can not call back into Python
+    '''
+    if isinstance(obj, dict):
+        return dict((k, prepare(v)) for k, v in obj.iteritems())
+    if isinstance(obj, (list, tuple)):
+        if any(isinstance(v, _special + (dict, list, tuple)) for v in obj):
+            return [prepare(v) for v in obj]
+        return obj
+    if isinstance(obj, _special):
+        return default(obj)
+    return obj
+
+def create_serializer(backend='json'):
+    '''
+    Returns a function encoding a result as a JSON string with backend, one
+    of json, simplejson or ujson
+    '''
+    if backend == 'json':
+        return json.JSONEncoder(default=default).encode
+    if backend == 'simplejson':
+        if simplejson is None:
+            raise RuntimeError('The simplejson package is required for the '
+                               'simplejson JSON backend')
+        return simplejson.JSONEncoder(default=default).encode
+    if backend == 'ujson':
+        if ujson is None:
+            raise RuntimeError('The ujson package is required for the ujson '
+                               'JSON backend')
+        return lambda obj: ujson.dumps(prepare(obj), double_precision=15)
+    raise ValueError('Unknown JSON backend %r' % backend)
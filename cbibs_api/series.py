@@ -0,0 +1,149 @@
+#!/usr/bin/env python
+#-*- coding: utf-8 -*-
+'''
+cbibs_api.series
+~~~~~~~~~~~~~~~~
+
+Series scoped queries.  A series is a single depth named measurement (see
+cbibs.depth_naming) at a single station.  The measurement name is resolved to
+the ids used by cbibs.f_observation up front so that only the observations for
+that series are fetched from the database.
+
+Copyright 2015 RPS ASA
+See LICENSE.txt
+'''
+
+from cbibs_api import db
+from cbibs_api.queries import SQL
+from cbibs_api.serializers import format_times
+from cbibs_api.utils import stream_query
+from collections import namedtuple
+from datetime import datetime
+from dateutil.parser import parse as dateparse
+from itertools import chain
+import base64
+import pandas as pd
+
+SERIES_COLUMNS = ['measure_ts', 'measurement', 'report_name', 'obs_value',
+                  'units', 'primary_qc']
+
+# prefix of the decoded form of a cursor
+CURSOR_PREFIX = 'measure_ts>'
+
+Series = namedtuple('Series', ['measurement', 'station_id', 'variable_ids',
+                               'location_ids'])
+
+def resolve_many(constellation, stations, measurements):
+    '''
+    Resolves every combination of stations and depth named measurements.
+    Returns a dict of (station, measurement) to Series for the combinations
+    which are reported.
+    '''
+    params = {
+        'constellation': constellation,
+        'stations': list(stations),
+        'measurements': list(measurements)
+    }
+    rows = db.engine.execute(SQL['ResolveSeries'], params).fetchall()
+    grouped = {}
+    for row in rows:
+        grouped.setdefault((row['station'], row['measurement']), []).append(row)
+    return dict((key, Series(key[1],
+                             rows[0]['station_id'],
+                             sorted(set(row['variable_id'] for row in rows)),
+                             sorted(set(row['location_id'] for row in rows))))
+                for key, rows in grouped.iteritems())
+
+def resolve_series(constellation, station, measurement):
+    '''
+    Returns the Series for a depth named measurement at a station, or None if
+    the station does not report the measurement.
+    '''
+    resolved = resolve_many(constellation, [station], [measurement])
+    return resolved.get((station, measurement))
+
+def query_series(series, beg_date, end_date, sql_name='QueryData', **params):
+    '''
+    Returns a DataFrame of the good, non-null observations for a series between
+    beg_date and end_date, ordered by time.
+    :param series: Series returned by resolve_series, or None
+    :param beg_date: ISO 8601 string for the start of the range (exclusive)
+    :param end_date: ISO 8601 string for the end of the range (exclusive)
+    :param sql_name: stored query to run, QueryData unless the query needs
+                     further parameters, which are passed as keywords
+    '''
+    if series is None:
+        return pd.DataFrame(columns=SERIES_COLUMNS)
+    params.update(series_params(series, beg_date, end_date))
+    return pd.read_sql(SQL[sql_name], db.engine, params=params)
+
+def query_many(series, beg_date, end_date):
+    '''
+    Returns a DataFrame of the good, non-null observations of several series
+    between beg_date and end_date with a single query, ordered by station,
+    measurement and time.  The series must cover every combination of their
+    stations and measurements, as returned by resolve_many.
+    :param series: list of Series
+    :param beg_date: ISO 8601 string for the start of the range (exclusive)
+    :param end_date: ISO 8601 string for the end of the range (exclusive)
+    '''
+    if not series:
+        return pd.DataFrame(columns=['station'] + SERIES_COLUMNS)
+    params = {
+        'measurements': sorted(set(s.measurement for s in series)),
+        'station_ids': sorted(set(s.station_id for s in series)),
+        'variable_ids': sorted(set(chain.from_iterable(s.variable_ids for s in series))),
+        'location_ids': sorted(set(chain.from_iterable(s.location_ids for s in series))),
+        'beg_date': beg_date,
+        'end_date': end_date
+    }
+    return pd.read_sql(SQL['QueryDataMulti'], db.engine, params=params)
+
+def stream_series(series, beg_date, end_date, batch_size, sql_name='QueryData'):
+    '''
+    Generates the rows query_series would return in lists of at most
+    batch_size rows, read from a server side cursor
+    '''
+    if series is None:
+        return iter([])
+    params = series_params(series, beg_date, end_date)
+    return stream_query(sql_name, params, batch_size)
+
+def series_columns(batches):
+    '''
+    Generates (times, values) lists from batches of series rows
+    '''
+    for rows in batches:
+        yield (format_times([row['measure_ts'] for row in rows]),
+               [row['obs_value'] for row in rows])
+
+def series_params(series, beg_date, end_date):
+    return {
+        'measurement': series.measurement,
+        'station_id': series.station_id,
+        'variable_ids': series.variable_ids,
+        'location_ids': series.location_ids,
+        'beg_date': beg_date,
+        'end_date': end_date
+    }
+
+def encode_cursor(measure_ts):
+    '''
+    Returns the opaque cursor resuming a series after measure_ts
+    '''
+    measure_ts = pd.Timestamp(measure_ts).to_pydatetime().replace(tzinfo=None)
+    return base64.urlsafe_b64encode(CURSOR_PREFIX + measure_ts.isoformat())
+
+def decode_since(since):
+    '''
+    Returns the time a since argument stands for, as a naive UTC datetime.
+    since is a cursor returned by encode_cursor or else a timestamp.  Raises
+    ValueError if it is neither.
+    '''
+    try:
+        decoded = base64.urlsafe_b64decode(str(since))
+    except (TypeError, ValueError):
+        decoded = ''
+    if decoded.startswith(CURSOR_PREFIX):
+        return dateparse(decoded[len(CURSOR_PREFIX):])
+    return dateparse(since, ignoretz=True)
@@ -1,10 +1,31 @@
 from cbibs_api import app, db
-from flask import jsonify, request, current_app, make_response
+from flask import jsonify, request, current_app, make_response, g, has_app_context
+from flask import Response, stream_with_context
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
 from functools import wraps
 from cbibs_api.queries import SQL
+from cbibs_api.rpc import RpcCall, decode_call
+from cbibs_api.serializers import create_serializer
 from collections import OrderedDict
 from defusedxml.xmlrpc import xmlrpc_client
+from tempfile import SpooledTemporaryFile
+from io import BytesIO
 import json
+import numpy as np
+
+# stored queries which can be prepared, by their text
+prepared_by_text = dict((sql, sql) for sql in SQL.itervalues() if sql.preparable)
+
+# encodes JSON responses, see cbibs_api.serializers
+json_dumps = create_serializer(app.config.get('JSON_BACKEND', 'json'))
+
+# binary representations, only sent to clients naming them in Accept
+NPZ_MEDIATYPE = 'application/x-npz'
+BINARY_MEDIATYPES = (NPZ_MEDIATYPE,)
+
+# bytes of spooled array members held in memory before spilling to disk
+SPOOL_SIZE = 1024 * 1024
 
 class UnauthorizedError(Exception):
     pass
@@ -20,6 +41,58 @@ def jsonify_status(json_dict, response_code=200):
     res.status_code = response_code
     return res
 
+@event.listens_for(Engine, 'before_cursor_execute')
+def count_query(conn, cursor, statement, parameters, context, executemany):
+    """
+    Counts the queries executed while handling the current request in
+    g.query_count
+    """
+    if has_app_context():
+        g.query_count = getattr(g, 'query_count', 0) + 1
+
+@app.before_request
+def reset_query_count():
+    """
+    Starts the count of each request at zero, g outlives the request when its
+    app context is shared, as it is by the requests of a test
+    """
+    g.query_count = 0
+
+# failures to prepare a stored query are not retried
+unpreparable = set()
+
+@event.listens_for(Engine, 'before_cursor_execute', retval=True)
+def use_prepared_statement(conn, cursor, statement, parameters, context,
+                           executemany):
+    """
+    Runs stored queries as server side prepared statements when
+    PREPARED_STATEMENTS is set, preparing each one on a connection the first
+    time it is used there.  Queries read from a server side cursor are left
+    alone, DECLARE can not take an EXECUTE.
+    """
+    stored = prepared_by_text.get(statement)
+    if (stored is None or executemany or stored.name in unpreparable or
+            not app.config.get('PREPARED_STATEMENTS') or
+            context.execution_options.get('stream_results')):
+        return statement, parameters
+    # prepared statements belong to the database session, so are tracked
+    # by backend pid in case the connection was replaced
+    pid = cursor.connection.get_backend_pid()
+    if conn.info.get('prepared_pid') != pid:
+        conn.info['prepared_pid'] = pid
+        conn.info['prepared'] = set()
+    if stored.name not in conn.info['prepared']:
+        try:
+            cursor.execute('SAVEPOINT prepare_statement; %s; '
+                           'RELEASE SAVEPOINT prepare_statement' % stored.prepare_sql)
+        except Exception:
+            cursor.execute('ROLLBACK TO SAVEPOINT prepare_statement')
+            unpreparable.add(stored.name)
+            app.logger.exception('Could not prepare %s', stored.name)
+            return statement, parameters
+        conn.info['prepared'].add(stored.name)
+    return stored.execute_sql, parameters
+
 def check_api_key_and_req_type(fn):
     """
     Wrapper to check that API key is supplied and valid and that the HTTP
@@ -36,21 +109,10 @@ def check_api_key_and_req_type(fn):
                 return fn(*args, **kwargs)
             raise UnauthorizedError('Incorrect API key, or API key not supplied')
         elif request.method == 'POST':
-            try:
-                if request.content_type == 'text/xml':
-                    payload = xmlrpc_client.loads(request.data)
-                    current_key = payload[0][-1]
-                else:
-                    json_req = request.get_json(force=True, silent=True)
-                    # if a non empty or valid JSON response, try to grab the key
-                    if not json_req:
-                        raise UnauthorizedError('Incorrect API key, or API key not supplied') 
-                    current_key = json_req.get('params').pop()
-                # if the get returns none and tries to index (TypeError),
-                # or params is empty (IndexError) return None
-            except TypeError, IndexError:
-                current_key = None
-            if current_key == app.config['API_KEY']:
+            call = decode_call()
+            # JSON-RPC batches are authenticated call by call
+            if (isinstance(call, RpcCall) and
+                    call.api_key == app.config['API_KEY']):
                 return fn(*args, **kwargs)
         raise UnauthorizedError('Incorrect API key, or no API key specified')
     return wrapper
@@ -66,16 +128,297 @@ def request_wants_xml():
 
 def output_json(data, code, headers=None):
     res = {'id' : 1, 'result' : data, 'error': None}
-    response = make_response(json.dumps(res), code)
+    response = make_response(json_dumps(res), code)
     response.headers.extend(headers or {})
     return response
 
+# XML-RPC encoding.  Produces the same document as xmlrpclib.dumps, but
+# arrays holding values of a single type are encoded in bulk instead of
+# dispatching on the type of every value.
+
+XML_HEADER = "<?xml version='1.0'?>\n<methodResponse>\n<params>\n<param>\n"
+XML_FOOTER = '</param>\n</params>\n</methodResponse>\n'
+
+def _xml_escape(value):
+    if isinstance(value, unicode):
+        return xmlrpc_client.escape(value).encode('utf-8', 'xmlcharrefreplace')
+    return xmlrpc_client.escape(value)
+
+def _xml_fallback(value):
+    """
+    Encodes a value of any other type with xmlrpclib itself
+    """
+    params = xmlrpc_client.dumps((value,))
+    return params[len('<params>\n<param>\n'):-len('</param>\n</params>\n')]
+
+def _xml_value(value):
+    """
+    Encodes a value the same way as xmlrpclib
+    """
+    chunks = []
+    _xml_dump(value, chunks.append)
+    return ''.join(chunks)
+
+def _xml_join(items, tag):
+    return ('<value><%s>' % tag +
+            ('</%s></value>\n<value><%s>' % (tag, tag)).join(items) +
+            '</%s></value>\n' % tag)
+
+def _xml_array_items(items):
+    """
+    Encodes the values of an array the same way as xmlrpclib
+    """
+    if not len(items):
+        return ''
+    types = set(map(type, items))
+    if types == set([float]):
+        return _xml_join(map(repr, items), 'double')
+    if types == set([str]) or types == set([unicode]):
+        joined = ''.join(items)
+        # most arrays hold timestamps or names, with nothing to escape
+        if '&' in joined or '<' in joined or '>' in joined:
+            items = map(xmlrpc_client.escape, items)
+        encoded = _xml_join(items, 'string')
+        if types == set([unicode]):
+            encoded = encoded.encode('utf-8', 'xmlcharrefreplace')
+        return encoded
+    if (types == set([int]) and xmlrpc_client.MININT <= min(items) and
+            max(items) <= xmlrpc_client.MAXINT):
+        return _xml_join(map(str, items), 'int')
+    chunks = []
+    for item in items:
+        _xml_dump(item, chunks.append)
+    return ''.join(chunks)
+
+def _xml_dump(value, write):
+    kind = type(value)
+    if kind is float:
+        write('<value><double>%r</double></value>\n' % value)
+    elif kind is str or kind is unicode:
+        write('<value><string>%s</string></value>\n' % _xml_escape(value))
+    elif kind is int and xmlrpc_client.MININT <= value <= xmlrpc_client.MAXINT:
+        write('<value><int>%d</int></value>\n' % value)
+    elif kind is bool:
+        write('<value><boolean>%d</boolean></value>\n' % value)
+    elif kind is list or kind is tuple:
+        write('<value><array><data>\n')
+        write(_xml_array_items(value))
+        write('</data></array></value>\n')
+    elif kind is dict:
+        write('<value><struct>\n')
+        for key, member in value.items():
+            if type(key) is unicode:
+                key = key.encode('utf-8')
+            elif type(key) is not str:
+                raise TypeError('dictionary key must be string')
+            write('<member>\n<name>%s</name>\n' % xmlrpc_client.escape(key))
+            _xml_dump(member, write)
+            write('</member>\n')
+        write('</struct></value>\n')
+    else:
+        write(_xml_fallback(value))
+
+def xml_response(data):
+    """
+    Returns the XML-RPC methodResponse document for data, identical to
+    xmlrpclib.dumps((data,), methodresponse=True)
+    """
+    chunks = [XML_HEADER]
+    _xml_dump(data, chunks.append)
+    chunks.append(XML_FOOTER)
+    return ''.join(chunks)
+
 def output_xml(data, code, headers=None):
     if hasattr(data, '__dict__'):
-        xml_str = xmlrpc_client.dumps((dict(data),), methodresponse=True)
+        data = dict(data)
+    response = make_response(xml_response(data), code)
+    response.headers.extend(headers or {})
+    return response
+
+class ColumnarResult(object):
+    """
+    A result made of equal length NumPy arrays, returned by the columns()
+    method of a resource for the binary representations.
+    :param members: OrderedDict of the scalar members, such as units
+    :param columns: OrderedDict of the arrays by name
+    """
+    def __init__(self, members, columns):
+        self.members = members
+        self.columns = columns
+
+def output_npz(data, code, headers=None):
+    """
+    Returns a response holding a ColumnarResult as a NumPy .npz archive, one
+    array per column and a 0-d array per member, readable with numpy.load.
+    Any other result, such as an error, is written as 0-d arrays of its
+    items.
+    """
+    if isinstance(data, ColumnarResult):
+        arrays = OrderedDict((k, np.asarray(v if v is not None else ''))
+                             for k, v in data.members.iteritems())
+        arrays.update(data.columns)
+    else:
+        arrays = dict((k, np.asarray(v if v is not None else ''))
+                      for k, v in dict(data).iteritems())
+    buf = BytesIO()
+    if app.config.get('NPZ_COMPRESS', True):
+        np.savez_compressed(buf, **arrays)
+    else:
+        np.savez(buf, **arrays)
+    response = make_response(buf.getvalue(), code)
+    response.headers.extend(headers or {})
+    return response
+
+
+class StreamedColumns(object):
+    """
+    A struct result whose array members are produced batch by batch, so the
+    complete result is never held in memory.  Encoded by stream_json and
+    stream_xml.
+    :param members: OrderedDict of the scalar members preceding the arrays
+    :param columns: names of the array members
+    :param batches: iterable of tuples holding one list per column
+    :param parent: if set, the arrays are members of a nested struct with
+                   this name instead of the top level struct
+    """
+    def __init__(self, members, columns, batches, parent=None):
+        self.members = members
+        self.columns = columns
+        self.batches = batches
+        self.parent = parent
+
+class StreamedText(object):
+    """
+    A string result produced chunk by chunk, such as a template being
+    rendered.  Encoded by stream_json and stream_xml.
+    :param chunks: iterable of str or unicode chunks
+    """
+    def __init__(self, chunks):
+        self.chunks = chunks
+
+def stream_query(sql_name, params, batch_size):
+    """
+    Generates lists of at most batch_size rows of a stored query, read from a
+    server side cursor
+    """
+    conn = db.engine.connect().execution_options(stream_results=True)
+    try:
+        res = conn.execute(SQL[sql_name], params)
+        rows = res.fetchmany(batch_size)
+        while rows:
+            yield rows
+            rows = res.fetchmany(batch_size)
+    finally:
+        conn.close()
+
+def _column_chunks(result, encode, separator):
+    """
+    Generates (name, chunks) for each array member of a StreamedColumns.  The
+    chunks of the first column are encoded as the batches arrive, the others
+    are spooled to temporary files until it is complete.  The chunks of each
+    column must be consumed before moving to the next column.
+    """
+    spools = [SpooledTemporaryFile(max_size=SPOOL_SIZE) for c in result.columns[1:]]
+
+    def first_column():
+        started = [False] * len(result.columns)
+        for batch in result.batches:
+            for i, items in enumerate(batch):
+                if not len(items):
+                    continue
+                chunk = (separator if started[i] else '') + encode(items)
+                started[i] = True
+                if i == 0:
+                    yield chunk
+                else:
+                    spools[i - 1].write(chunk)
+
+    def spooled_column(spool):
+        spool.seek(0)
+        chunk = spool.read(SPOOL_SIZE)
+        while chunk:
+            yield chunk
+            chunk = spool.read(SPOOL_SIZE)
+        spool.close()
+
+    yield result.columns[0], first_column()
+    for name, spool in zip(result.columns[1:], spools):
+        yield name, spooled_column(spool)
+
+def _json_items(items):
+    return json_dumps(items)[1:-1]
+
+def _json_stream(result):
+    yield '{"id": 1, "result": {'
+    prefix = ''
+    for key, value in result.members.iteritems():
+        yield prefix + json.dumps(key) + ': ' + json.dumps(value)
+        prefix = ', '
+    if result.parent:
+        yield prefix + json.dumps(result.parent) + ': {'
+        prefix = ''
+    for name, chunks in _column_chunks(result, _json_items, ', '):
+        yield prefix + json.dumps(name) + ': ['
+        for chunk in chunks:
+            yield chunk
+        yield ']'
+        prefix = ', '
+    if result.parent:
+        yield '}'
+    yield '}, "error": null}'
+
+def _json_text_stream(result):
+    yield '{"id": 1, "result": "'
+    for chunk in result.chunks:
+        # escaping is done character by character, so the escaped chunks
+        # join up to the escaped string
+        yield json.dumps(chunk)[1:-1]
+    yield '", "error": null}'
+
+def _xml_stream(result):
+    yield XML_HEADER + '<value><struct>\n'
+    for key, value in result.members.iteritems():
+        yield '<member>\n<name>%s</name>\n%s</member>\n' % (_xml_escape(key),
+                                                           _xml_value(value))
+    if result.parent:
+        yield '<member>\n<name>%s</name>\n<value><struct>\n' % _xml_escape(result.parent)
+    for name, chunks in _column_chunks(result, _xml_array_items, ''):
+        yield '<member>\n<name>%s</name>\n<value><array><data>\n' % _xml_escape(name)
+        for chunk in chunks:
+            yield chunk
+        yield '</data></array></value>\n</member>\n'
+    if result.parent:
+        yield '</struct></value>\n</member>\n'
+    yield '</struct></value>\n' + XML_FOOTER
+
+def _xml_text_stream(result):
+    yield XML_HEADER + '<value><string>'
+    for chunk in result.chunks:
+        yield _xml_escape(chunk)
+    yield '</string></value>\n' + XML_FOOTER
+
+def stream_json(result, code=200, headers=None):
+    """
+    Returns a response writing a StreamedColumns or StreamedText result in a
+    JSON-RPC envelope as it is produced
+    """
+    if isinstance(result, StreamedText):
+        chunks = _json_text_stream(result)
     else:
-        xml_str = xmlrpc_client.dumps((data,), methodresponse=True)
-    response = make_response(xml_str, code)
+        chunks = _json_stream(result)
+    response = Response(stream_with_context(chunks), code)
     response.headers.extend(headers or {})
     return response
 
+def stream_xml(result, code=200, headers=None):
+    """
+    Returns a response writing a StreamedColumns or StreamedText result in an
+    XML-RPC envelope as it is produced
+    """
+    if isinstance(result, StreamedText):
+        chunks = _xml_text_stream(result)
+    else:
+        chunks = _xml_stream(result)
+    response = Response(stream_with_context(chunks), code)
+    response.headers.extend(headers or {})
+    return response
@@ -0,0 +1,24 @@
+#!/usr/bin/env python
+'''
+conftest
+
+Runs the tests against the asynchronous serving mode of app_async with
+
+    py.test --async-mode tests
+
+which also runs the tests of tests/test_cbibs_api.py against the gevent
+server, see tests/test_async.py
+'''
+
+def pytest_addoption(parser):
+    parser.addoption('--async-mode', action='store_true', default=False,
+                     help='patch the standard library and psycopg2 for '
+                          'gevent and size the database pool as app_async '
+                          'does, before the tests run')
+
+def pytest_configure(config):
+    if config.getoption('--async-mode'):
+        from app_async import patch, configure_pool
+        patch()
+        from cbibs_api import app
+        configure_pool(app)
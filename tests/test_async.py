@@ -0,0 +1,118 @@
+#!/usr/bin/env python
+'''
+tests/test_async.py
+
+Tests the gevent server of app_async, and runs the tests of
+test_cbibs_api.py against it.  Only run in the asynchronous mode:
+
+    py.test --async-mode tests
+'''
+
+import json
+import unittest
+import urllib
+import urllib2
+
+# imported as a module, so that pytest does not collect TestJsonApi twice
+import test_cbibs_api
+
+try:
+    from gevent import monkey
+    import gevent
+    ASYNC_MODE = monkey.is_module_patched('socket')
+except ImportError:
+    ASYNC_MODE = False
+
+@unittest.skipUnless(ASYNC_MODE, 'run with py.test --async-mode')
+class TestAsyncServer(unittest.TestCase):
+    def setUp(self):
+        from app_async import create_server
+        from cbibs_api import app
+        self.api_key = app.config['API_KEY']
+        self.server = create_server('127.0.0.1', 0, 100)
+        self.server.start()
+        self.url = 'http://127.0.0.1:%d' % self.server.server_port
+
+    def tearDown(self):
+        self.server.stop()
+
+    def post(self, method, params):
+        payload = json.dumps({'method': method, 'params': params, 'id': 1})
+        req = urllib2.Request(self.url + '/', payload,
+                              {'Content-Type': 'application/json'})
+        return json.loads(urllib2.urlopen(req).read())
+
+    def test_concurrent_requests(self):
+        params = ['CBIBS', 'J', self.api_key]
+        expected = self.post('RetrieveCurrentReadings', params)
+        jobs = [gevent.spawn(self.post, 'RetrieveCurrentReadings', params)
+                for i in range(50)]
+        jobs += [gevent.spawn(lambda: urllib2.urlopen(self.url + '/test').read())
+                 for i in range(50)]
+        gevent.joinall(jobs, timeout=60, raise_error=True)
+        for job in jobs[:50]:
+            assert job.value == expected
+        for job in jobs[50:]:
+            assert json.loads(job.value) == {'msg': 'test successful'}
+
+class ServerClient(object):
+    '''
+    Stands in for the Flask test client, sending each request to a running
+    server over HTTP
+    '''
+    def __init__(self, url):
+        self.url = url
+
+    def __enter__(self):
+        # the request context of a served request stays in the server
+        raise unittest.SkipTest('g can not be inspected through a server')
+
+    def __exit__(self, *exc_info):
+        return False
+
+    def open(self, path, method, data=None, headers=None):
+        from cbibs_api import app
+        if isinstance(data, dict):
+            data = urllib.urlencode(data)
+        elif data is None and method == 'POST':
+            data = ''
+        req = urllib2.Request(self.url + path, data, dict(headers or {}))
+        req.get_method = lambda: method
+        try:
+            response = urllib2.urlopen(req)
+        except urllib2.HTTPError as e:
+            response = e
+        if response.info().get('Transfer-Encoding') == 'chunked':
+            # a streamed response, read as the test client would
+            body = iter(lambda: response.read(8192), '')
+        else:
+            body = response.read()
+        return app.response_class(body, status=response.code,
+                                  headers=response.info().items())
+
+    def get(self, path, **kwargs):
+        return self.open(path, 'GET', **kwargs)
+
+    def post(self, path, **kwargs):
+        return self.open(path, 'POST', **kwargs)
+
+@unittest.skipUnless(ASYNC_MODE, 'run with py.test --async-mode')
+class TestAsyncJsonApi(test_cbibs_api.TestJsonApi):
+    '''
+    The tests of TestJsonApi, sent to the gevent server.  Tests which inspect
+    g after a request are skipped.
+    '''
+    def setUp(self):
+        test_cbibs_api.TestJsonApi.setUp(self)
+        from app_async import create_server
+        from cbibs_api import app
+        self.server = create_server('127.0.0.1', 0,
+                                    app.config.get('ASYNC_CONCURRENCY', 100))
+        self.server.start()
+        self.client = ServerClient('http://127.0.0.1:%d' % self.server.server_port)
+
+    def tearDown(self):
+        self.server.stop()
+
+if __name__ == '__main__':
+    unittest.main()
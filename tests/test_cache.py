@@ -0,0 +1,79 @@
+#!/usr/bin/env python
+'''
+tests/test_cache.py
+
+Unit tests for the query result and response caches
+'''
+
+from cbibs_api.cache import TTLCache, MISSING, ResponseCache, SqliteBackend
+
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+
+class TestTTLCache(unittest.TestCase):
+    def test_expiry(self):
+        cache = TTLCache()
+        cache.set('a', 1, 60)
+        cache.set('b', 2, -1)
+        assert cache.get('a') == 1
+        assert cache.get('b') is MISSING
+        assert cache.get('c') is MISSING
+
+    def test_lru_eviction(self):
+        cache = TTLCache(max_entries=2)
+        cache.set('a', 1, 60)
+        cache.set('b', 2, 60)
+        cache.get('a')
+        cache.set('c', 3, 60)
+        assert cache.get('b') is MISSING
+        assert cache.get('a') == 1
+        assert cache.get('c') == 3
+
+class TestResponseCache(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'responses.sqlite')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_hit_and_clear(self):
+        cache = ResponseCache(SqliteBackend(self.path))
+        key = cache.make_key('RetrieveCurrentReadings', ['cbibs', 'J'],
+                             'application/json')
+        assert cache.get_or_compute(key, 60, lambda: 'first') == 'first'
+        assert cache.get_or_compute(key, 60, lambda: 'second') == 'first'
+        cache.clear()
+        assert cache.get_or_compute(key, 60, lambda: 'third') == 'third'
+
+    def test_key_includes_mediatype(self):
+        json_key = ResponseCache.make_key('ListQACodes', [], 'application/json')
+        xml_key = ResponseCache.make_key('ListQACodes', [], 'text/xml')
+        assert json_key != xml_key
+
+    def test_coalesced_misses(self):
+        '''Concurrent misses from separate workers compute the value once'''
+        calls = []
+        def compute():
+            calls.append(1)
+            time.sleep(0.2)
+            return 'value'
+
+        # one cache per simulated worker, sharing the same store
+        caches = [ResponseCache(SqliteBackend(self.path)) for i in range(4)]
+        results = []
+        threads = [threading.Thread(target=lambda c=c: results.append(
+                       c.get_or_compute('key', 60, compute))) for c in caches]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert len(calls) == 1
+        assert results == ['value'] * 4
+
+if __name__ == '__main__':
+    unittest.main()
@@ -6,6 +6,9 @@ Unit tests for the CBIBS API Methods
 '''
 
 from cbibs_api.api import app
+from cbibs_api.serializers import format_times
+from cbibs_api.series import encode_cursor, decode_since
+from flask import g, request
 from flask.ext.testing import TestCase
 from dateutil.parser import parse as dateparse
 from datetime import datetime
@@ -14,9 +17,15 @@ from jinja2 import Environment, FileSystemLoader
 # safe since we're parsing trusted input
 from lxml import etree
 
+from io import BytesIO
+from StringIO import StringIO
+import csv
 import json
 import unittest
+import xmlrpclib
+import zlib
 import numpy as np
+import pandas as pd
 
 JSON_HEADERS = {
     "Content-Type": "application/json",
@@ -160,6 +169,341 @@ class TestJsonApi(TestCase):
 
         assert len(times) == len(values) and len(values) > 3
 
+    def test_query_data_unknown_measurement(self):
+        arg_arr = ['CBIBS', 'J', 'not_a_measurement', '2015-10-01',
+                    '2015-10-02']
+        post_response = self.make_json_payload('QueryData', arg_arr)
+        assert post_response.status_code == 200
+        json_response = json.loads(post_response.data)
+        assert json_response['result'] == {}
+
+        post_response = self.make_json_payload('QueryDataSimple', arg_arr)
+        json_response = json.loads(post_response.data)
+        assert json_response['result'] == {'time': [], 'value': []}
+
+    def test_streamed_query_data(self):
+        arg_arr = ['CBIBS', 'J', 'sea_water_temperature', '2015-10-01',
+                    '2015-10-02']
+        config = dict((k, app.config.get(k)) for k in
+                      ('STREAMING', 'STREAMING_MIN_DAYS', 'STREAMING_BATCH_SIZE'))
+        try:
+            for method in ('QueryData', 'QueryDataSimple', 'QueryDataRaw'):
+                app.config['STREAMING'] = False
+                expected_json = json.loads(self.make_json_payload(method, arg_arr).data)
+                expected_xml = etree.fromstring(self.make_xml_payload(method, arg_arr).data)
+
+                # stream every range in small batches
+                app.config.update(STREAMING=True, STREAMING_MIN_DAYS=0,
+                                  STREAMING_BATCH_SIZE=5)
+                post_response = self.make_json_payload(method, arg_arr)
+                assert post_response.status_code == 200
+                assert json.loads(post_response.data) == expected_json
+
+                post_response = self.make_xml_payload(method, arg_arr)
+                assert post_response.status_code == 200
+                root = etree.fromstring(post_response.data)
+                for path in (".//member[name/text()='time']/value/array/data/value/string",
+                             ".//member[name/text()='value']/value/array/data/value/double"):
+                    assert ([e.text for e in root.xpath(path)] ==
+                            [e.text for e in expected_xml.xpath(path)])
+        finally:
+            app.config.update(config)
+
+    def test_streamed_query_data_by_time(self):
+        arg_arr = ['CBIBS', 'J', 'sea_water_temperature', '2015-10-01',
+                    '2015-10-02']
+        config = dict((k, app.config.get(k)) for k in
+                      ('STREAMING', 'STREAMING_MIN_DAYS', 'STREAMING_BATCH_SIZE'))
+        from cbibs_api.api import QueryDataByTime
+        try:
+            # the document rendered at once from the buffered table, responses
+            # are always streamed
+            app.config['STREAMING'] = False
+            with app.test_request_context('/'):
+                request.args = dict(zip(QueryDataByTime.keys, arg_arr))
+                expected = QueryDataByTime().get()
+            assert expected.count('<time>') > 2
+
+            for streaming in ({'STREAMING': False},
+                              {'STREAMING': True, 'STREAMING_MIN_DAYS': 0,
+                               'STREAMING_BATCH_SIZE': 5}):
+                app.config.update(streaming)
+                post_response = self.make_json_payload('QueryDataByTime', arg_arr)
+                assert post_response.is_streamed
+                assert json.loads(post_response.data)['result'] == expected
+                post_response = self.make_xml_payload('QueryDataByTime', arg_arr)
+                (result,), method = xmlrpclib.loads(post_response.data)
+                assert result == expected
+        finally:
+            app.config.update(config)
+
+    def test_npz_query_data(self):
+        arg_arr = ['CBIBS', 'J', 'sea_water_temperature', '2015-10-01',
+                    '2015-10-02']
+        headers = dict(JSON_HEADERS, Accept='application/x-npz')
+        for method in ('QueryData', 'QueryDataSimple', 'QueryDataRaw'):
+            expected = json.loads(self.make_json_payload(method, arg_arr).data)['result']
+            expected = expected.get('values', expected)
+            payload = json.dumps({'method': method, 'id': 1,
+                                  'params': arg_arr + [self.API_KEY]})
+            post_response = self.client.post('/', data=payload, headers=headers)
+            assert post_response.status_code == 200
+            assert post_response.headers['Content-Type'] == 'application/x-npz'
+            arrays = np.load(BytesIO(post_response.data))
+            assert arrays['time'].dtype == np.dtype('datetime64[s]')
+            assert format_times(arrays['time']) == expected['time']
+            assert arrays['value'].tolist() == expected['value']
+        assert str(arrays['units']) == 'C'
+
+        # a series which does not resolve has empty columns
+        payload = json.dumps({'method': 'QueryDataAggregated', 'id': 1,
+                              'params': ['CBIBS', 'NONE'] + arg_arr[2:] +
+                                        ['day', self.API_KEY]})
+        post_response = self.client.post('/', data=payload, headers=headers)
+        assert post_response.status_code == 200
+        arrays = np.load(BytesIO(post_response.data))
+        assert len(arrays['time']) == len(arrays['mean']) == 0
+
+        # methods without columns are refused rather than sent as JSON
+        payload = json.dumps({'method': 'ListPlatforms', 'id': 1,
+                              'params': ['CBIBS', self.API_KEY]})
+        post_response = self.client.post('/', data=payload, headers=headers)
+        assert post_response.status_code == 406
+        assert 'error' in np.load(BytesIO(post_response.data))
+
+        # a text type the client prefers is chosen over npz
+        payload = json.dumps({'method': 'QueryData', 'id': 1,
+                              'params': arg_arr + [self.API_KEY]})
+        url = ('/api/QueryData?constellation=CBIBS&station=J'
+               '&measurement=sea_water_temperature&beg_date=2015-10-01'
+               '&end_date=2015-10-02&api_key=%s' % self.API_KEY)
+        for accept, mediatype in (
+                ('text/xml, application/x-npz;q=0.1', 'text/xml'),
+                ('application/json;q=1, application/x-npz;q=0.5', 'application/json'),
+                ('application/json;q=0.5, application/x-npz', 'application/x-npz')):
+            headers = dict(JSON_HEADERS, Accept=accept)
+            post_response = self.client.post('/', data=payload, headers=headers)
+            assert post_response.headers['Content-Type'] == mediatype
+            response = self.client.get(url, headers={'Accept': accept})
+            assert response.headers['Content-Type'] == mediatype
+
+    def test_export(self):
+        arg_arr = ['CBIBS', 'J', 'sea_water_temperature', '2015-10-01',
+                    '2015-10-02']
+        expected = json.loads(self.make_json_payload('QueryData', arg_arr).data)['result']
+        query = ('/export?station=J&measurement=sea_water_temperature'
+                 '&beg_date=2015-10-01&end_date=2015-10-02&api_key=%s' % self.API_KEY)
+
+        response = self.client.get(query)
+        assert response.status_code == 200
+        assert response.mimetype == 'text/csv'
+        rows = list(csv.reader(StringIO(response.data)))
+        assert rows[0] == ['time', 'measurement', 'value', 'units']
+        assert [row[0] for row in rows[1:]] == expected['values']['time']
+        assert [float(row[2]) for row in rows[1:]] == expected['values']['value']
+        assert set(row[3] for row in rows[1:]) == set(['C'])
+
+        response = self.client.get(query + '&format=ndjson')
+        assert response.status_code == 200
+        rows = [json.loads(line) for line in response.data.splitlines()]
+        assert [row['time'] for row in rows] == expected['values']['time']
+        assert [row['value'] for row in rows] == expected['values']['value']
+
+        assert self.client.get(query + '&format=xls').status_code == 400
+        assert self.client.get(query.replace(self.API_KEY, 'bad')).status_code == 401
+        assert self.client.get(query.replace('station=J', 'station=NONE')).status_code == 404
+
+    def test_compression(self):
+        for method, args in (('ListPlatforms', ['CBIBS']),
+                             ('RetrieveCurrentReadings', ['CBIBS', 'J'])):
+            plain = self.make_json_payload(method, args)
+            assert 'Content-Encoding' not in plain.headers
+            payload = json.dumps({'method': method, 'id': 1,
+                                  'params': args + [self.API_KEY]})
+            for encoding, wbits in (('gzip', 16 + zlib.MAX_WBITS),
+                                    ('deflate', zlib.MAX_WBITS)):
+                headers = dict(JSON_HEADERS, **{'Accept-Encoding': encoding})
+                # twice, for the cached responses to be hit
+                for i in range(2):
+                    response = self.client.post('/', data=payload, headers=headers)
+                    assert response.status_code == 200
+                    assert response.headers['Content-Encoding'] == encoding
+                    assert 'Accept-Encoding' in response.headers['Vary']
+                    assert zlib.decompress(response.data, wbits) == plain.data
+
+    def test_conditional_get(self):
+        url = '/api/RetrieveCurrentReadings?constellation=CBIBS&station=J&api_key=%s' % self.API_KEY
+        expected = json.loads(self.make_json_payload('RetrieveCurrentReadings',
+                                                     ['CBIBS', 'J']).data)
+        response = self.client.get(url)
+        assert response.status_code == 200
+        assert json.loads(response.data) == expected
+        etag = response.headers['ETag']
+        last_modified = response.headers['Last-Modified']
+        assert etag.startswith('W/"')
+        newest = max(expected['result']['time'])
+        assert dateparse(last_modified, ignoretz=True) == dateparse(newest)
+
+        # only the version is queried
+        with self.client:
+            response = self.client.get(url, headers={'If-None-Match': etag})
+            assert response.status_code == 304
+            assert g.query_count == 1
+        response = self.client.get(url, headers={'If-Modified-Since': last_modified})
+        assert response.status_code == 304
+        response = self.client.get(url, headers={'If-None-Match': 'W/"other"'})
+        assert response.status_code == 200
+        assert self.client.get(url.replace(self.API_KEY, 'bad')).status_code == 401
+
+        # XML is a different representation
+        response = self.client.get(url, headers={'Accept': 'text/xml'})
+        assert response.status_code == 200
+        assert response.headers['ETag'] != etag
+
+    def test_conditional_catalog(self):
+        from cbibs_api.api import BaseResource, ListPlatforms, catalog_cache
+        url = '/api/ListPlatforms?constellation=CBIBS&api_key=%s' % self.API_KEY
+        response = self.client.get(url)
+        assert response.status_code == 200
+        etag = response.headers['ETag']
+        platforms = json.loads(response.data)['result']['id']
+        response = self.client.get(url, headers={'If-None-Match': etag})
+        assert response.status_code == 304
+
+        # the version follows the result, which a flush does not change
+        self.client.post('/admin/flush_cache', data={'api_key': self.API_KEY})
+        response = self.client.get(url, headers={'If-None-Match': etag})
+        assert response.status_code == 304
+
+        # the platforms change by the time the cached result expires
+        def changed(resource, *args):
+            results = BaseResource._result_simple(resource, *args)
+            results['id'] = results['id'][:-1]
+            return results
+        ListPlatforms._result_simple = changed
+        try:
+            catalog_cache.clear()
+            response = self.client.get(url, headers={'If-None-Match': etag})
+            assert response.status_code == 200
+            assert response.headers['ETag'] != etag
+            assert json.loads(response.data)['result']['id'] == platforms[:-1]
+        finally:
+            del ListPlatforms._result_simple
+        catalog_cache.clear()
+
+    def test_unchanged_since(self):
+        for method, args in (('RetrieveCurrentReadings', ['CBIBS', 'J']),
+                             ('RetrieveCurrentSuperSet', ['WQJ'])):
+            expected = json.loads(self.make_json_payload(method, args).data)['result']
+            newest = max(expected['time'])
+            post_response = self.make_json_payload(method, args + [newest])
+            assert json.loads(post_response.data)['result'] == {}
+            post_response = self.make_xml_payload(method, args + [newest])
+            assert xmlrpclib.loads(post_response.data)[0] == ({},)
+            post_response = self.make_json_payload(method, args + ['2000-01-01'])
+            assert json.loads(post_response.data)['result'] == expected
+
+        post_response = self.make_json_payload('ListConstellations', ['2100-01-01'])
+        assert json.loads(post_response.data)['result'] == []
+
+    def test_query_data_since(self):
+        arg_arr = ['CBIBS', 'J', 'sea_water_temperature', '2015-10-01',
+                    '2015-10-02']
+        full = json.loads(self.make_json_payload('QueryDataSimple', arg_arr).data)['result']
+        assert 'cursor' not in full
+
+        since = full['time'][10]
+        result = json.loads(self.make_json_payload('QueryDataSimple', arg_arr + [since]).data)['result']
+        assert result['time'] == full['time'][11:]
+        assert result['value'] == full['value'][11:]
+        assert decode_since(result['cursor']) == dateparse(full['time'][-1])
+
+        # nothing new after the cursor, which stays put
+        cursor = result['cursor']
+        result = json.loads(self.make_json_payload('QueryDataSimple', arg_arr + [cursor]).data)['result']
+        assert result == {'time': [], 'value': [], 'cursor': cursor}
+
+        result = json.loads(self.make_json_payload('QueryData', arg_arr + [since]).data)['result']
+        assert result['values']['time'] == full['time'][11:]
+        assert result['cursor'] == cursor
+
+        post_response = self.make_xml_payload('QueryData', arg_arr + [since])
+        (result,), method = xmlrpclib.loads(post_response.data)
+        assert result['values']['time'] == full['time'][11:]
+        assert result['cursor'] == cursor
+
+    def test_cursor(self):
+        measure_ts = datetime(2015, 10, 1, 1, 0, 0, 500000)
+        assert decode_since(encode_cursor(measure_ts)) == measure_ts
+        assert decode_since(encode_cursor(pd.Timestamp('2015-10-01 01:00:00'))) == \
+            datetime(2015, 10, 1, 1)
+        assert decode_since('2015-10-01 01:00:00') == datetime(2015, 10, 1, 1)
+        assert decode_since('20151001') == datetime(2015, 10, 1)
+
+    def test_query_data_aggregated(self):
+        arg_arr = ['CBIBS', 'J', 'sea_water_temperature', '2015-10-01',
+                    '2015-10-02']
+        simple = json.loads(self.make_json_payload('QueryDataSimple', arg_arr).data)['result']
+
+        post_response = self.make_json_payload('QueryDataAggregated', arg_arr + ['day'])
+        assert post_response.status_code == 200
+        result = json.loads(post_response.data)['result']
+        assert result['units'] == 'C'
+        assert result['values']['time'] == ['2015-10-01 00:00:00']
+        assert result['values']['count'] == [len(simple['value'])]
+        assert result['values']['min'] == [min(simple['value'])]
+        assert result['values']['max'] == [max(simple['value'])]
+
+        post_response = self.make_json_payload('QueryDataAggregated', arg_arr + [4])
+        values = json.loads(post_response.data)['result']['values']
+        assert len(values['time']) == 4
+        assert sum(values['count']) == len(simple['value'])
+        for low, mean, high in zip(values['min'], values['mean'], values['max']):
+            assert low <= mean <= high
+
+        post_response = self.make_xml_payload('QueryDataAggregated', arg_arr + ['hour'])
+        assert post_response.status_code == 200
+        root = etree.fromstring(post_response.data)
+        times = root.xpath(".//member[name/text()='time']/value/array/data/value/string")
+        means = root.xpath(".//member[name/text()='mean']/value/array/data/value/double")
+        assert len(times) == len(means) == len(simple['time'])
+
+        for interval in ['week', 0]:
+            post_response = self.make_json_payload('QueryDataAggregated',
+                                                   arg_arr + [interval])
+            assert post_response.status_code == 400
+            assert json.loads(post_response.data)['error'] == \
+                'interval must be one of hour, day, month or a positive number of points'
+
+    def test_query_data_multi(self):
+        stations = ['J', 'SN']
+        measurements = ['sea_water_temperature', 'sea_water_salinity']
+        dates = ['2015-09-08', '2015-09-09']
+        arg_arr = ['CBIBS', stations, measurements] + dates
+        post_response = self.make_json_payload('QueryDataMulti', arg_arr)
+        assert post_response.status_code == 200
+        result = json.loads(post_response.data)['result']
+        assert sorted(result) == stations
+        for station in stations:
+            assert sorted(result[station]) == sorted(measurements)
+            for measurement in measurements:
+                single = self.make_json_payload('QueryData', ['CBIBS', station, measurement] + dates)
+                assert result[station][measurement] == json.loads(single.data)['result']
+
+        # comma separated lists are accepted too
+        post_response = self.make_json_payload('QueryDataMulti',
+                                               ['CBIBS', 'J,SN', ','.join(measurements)] + dates)
+        assert json.loads(post_response.data)['result'] == result
+
+        # the XML-RPC test template encodes strings only
+        post_response = self.make_xml_payload('QueryDataMulti',
+                                              ['CBIBS', 'J,SN', ','.join(measurements)] + dates)
+        assert post_response.status_code == 200
+        root = etree.fromstring(post_response.data)
+        times = root.xpath(".//member[name/text()='J']//member[name/text()='sea_water_temperature']"
+                           "//member[name/text()='time']/value/array/data/value/string")
+        assert len(times) == len(result['J']['sea_water_temperature']['values']['time'])
+
     def test_get_number_measurements(self):
         arg_arr = ['CBIBS', 'J', 'sea_water_salinity', '2014-08-01',
                    '2014-08-02']
@@ -202,6 +546,27 @@ class TestJsonApi(TestCase):
         assert len(json_response['result']['measurement']) > 0
         assert len(json_response['result']['time']) > 0
         assert json_response['result']['station'] == 'J'
+        # exactly one reading per measurement
+        assert len(json_response['result']['time']) == len(json_response['result']['measurement'])
+        assert len(json_response['result']['value']) == len(json_response['result']['measurement'])
+        assert 'error_count' not in json_response['result']['measurement']
+
+        # in the order the measurements first reported within the last two
+        # weeks, as before the readings were read from current_observation
+        from cbibs_api import db
+        first_reported = dict(db.engine.execute('''
+            SELECT cbibs.depth_naming(v.actual_name, l.elevation), min(o.measure_ts)
+            FROM cbibs.f_observation o
+            JOIN cbibs.d_variable v ON v.id = o.d_variable_id
+            JOIN cbibs.d_location l ON l.id = o.d_location_id
+            JOIN cbibs.d_station s ON s.id = o.d_station_id
+            JOIN cbibs.d_qa_code_primary qc ON qc.id = o.d_qa_code_primary_id
+            WHERE s.description = 'J' AND o.measure_ts > now() - interval '2 weeks'
+                AND o.obs_value IS NOT NULL AND qc.qa_code NOT IN (3, 4)
+            GROUP BY 1''').fetchall())
+        measurements = list(json_response['result']['measurement'])
+        assert measurements == sorted(measurements,
+                                      key=lambda m: (first_reported[m], m))
 
         post_response = self.make_xml_payload('RetrieveCurrentReadings', arg_arr)
         assert post_response.status_code == 200
@@ -304,6 +669,26 @@ class TestJsonApi(TestCase):
             assert post_response.status_code == 200
             root = etree.fromstring(post_response.data)
 
+    def test_method_registry(self):
+        from cbibs_api.registry import methods
+        assert methods['xmlrpc_cdrh.QueryData'] is methods['QueryData']
+        assert methods['jsonrpc_cdrh.QueryDataSimple'] is methods['QueryDataSimple']
+        assert 'jsonrpc_cdrh.QueryData' not in methods
+        # with and without the optional since
+        assert methods['QueryData'].signature == [['string'] + ['string'] * 5,
+                                                  ['string'] + ['string'] * 6]
+        assert methods['QueryData'].producers == {'text/xml': 'stream',
+                                                  'application/json': 'stream',
+                                                  'application/x-npz': 'columns'}
+        assert methods['ListPlatforms'].producers == {'text/xml': 'get',
+                                                      'application/json': 'get'}
+
+        post_response = self.make_json_payload('system.methodHelp', ['QueryData'])
+        assert 'JSON-RPC' in json.loads(post_response.data)['result']
+        post_response = self.make_xml_payload('system.methodHelp', ['QueryData'])
+        (help_string,), method = xmlrpclib.loads(post_response.data)
+        assert help_string.startswith('CDRH XML-RPC QueryData Function (')
+
     def test_get_capabilities(self):
         post_response = self.make_json_payload('system.getCapabilities', [])
         json_response = json.loads(post_response.data)
@@ -475,6 +860,10 @@ class TestJsonApi(TestCase):
         inner_doc = etree.fromstring(xpath_res[0].text)
         xpath_res = inner_doc.xpath(".//time")
         assert len(xpath_res) > 2
+        for time in xpath_res:
+            dateparse(time.text)
+            assert len(time.text) == 19
+            assert time.find('measurement').text == 'sea_water_temperature'
 
     def test_list_qa_codes(self):
         arg_arr = []
@@ -489,6 +878,171 @@ class TestJsonApi(TestCase):
         xpath_res = root.xpath(".//struct/member[name/text()='qacode']/value/array/data/value")
         assert len(xpath_res) == 6
 
+    def test_catalog_cache(self):
+        from cbibs_api.api import catalog_cache, response_cache, forget_catalog_version
+        catalog_cache.clear()
+        response_cache.clear()
+        first_response = self.make_json_payload('ListConstellations')
+        assert len(catalog_cache) == 1
+        # the XML response is not cached yet, the query result is
+        with self.client:
+            second_response = self.make_xml_payload('ListConstellations')
+            assert getattr(g, 'query_count', 0) == 0
+        assert len(catalog_cache) == 1
+        second_response = self.make_json_payload('ListConstellations')
+        assert first_response.data == second_response.data
+
+        post_response = self.client.post('/admin/flush_cache')
+        assert post_response.status_code == 401
+        assert len(catalog_cache) == 1
+
+        post_response = self.client.post('/admin/flush_cache',
+                                         data={'api_key': self.API_KEY})
+        assert post_response.status_code == 200
+        assert len(catalog_cache) == 0
+
+        # a flush through another worker clears the shared response cache and
+        # catalog version, which misses the entries cached by this one once
+        # it reads the version again
+        self.make_json_payload('ListConstellations')
+        assert len(catalog_cache) == 1
+        response_cache.clear()
+        with self.client:
+            self.make_json_payload('ListConstellations')
+            assert getattr(g, 'query_count', 0) == 0
+        forget_catalog_version()
+        with self.client:
+            # XML, the JSON response was cached again by the call above
+            self.make_xml_payload('ListConstellations')
+            assert g.query_count == 1
+
+    def test_pool_stats(self):
+        self.make_json_payload('ListPlatforms', ['CBIBS'])
+        get_response = self.client.get('/stats/pool')
+        assert get_response.status_code == 401
+
+        get_response = self.client.get('/stats/pool?api_key=' + self.API_KEY)
+        assert get_response.status_code == 200
+        stats = json.loads(get_response.data)
+        assert stats['pool'] == 'InstrumentedQueuePool'
+        assert stats['checkouts'] >= 1
+        assert stats['size'] == app.config['SQLALCHEMY_POOL_SIZE']
+        assert 0 <= stats['wait_max'] < app.config['SQLALCHEMY_POOL_TIMEOUT']
+
+    def test_one_query_per_call(self):
+        from cbibs_api.api import catalog_cache, response_cache
+        catalog_cache.clear()
+        response_cache.clear()
+        calls = [
+            ('ListStationsWithParam', ['CBIBS', 'sea_water_salinity']),
+            ('ListParameters', ['CBIBS', 'J']),
+            ('GetNumberMeasurements', ['CBIBS', 'J', 'sea_water_salinity',
+                                       '2014-08-01', '2014-08-02']),
+            ('LastMeasurementTime', ['CBIBS', 'J', 'sea_water_salinity']),
+            ('GetStationStatus', ['CBIBS', 'J'])
+        ]
+        for method, arg_arr in calls:
+            with self.client:
+                post_response = self.make_json_payload(method, arg_arr)
+                assert post_response.status_code == 200
+                assert g.query_count == 1, method
+
+        # introspection never touches the database
+        for method, arg_arr in [('system.listMethods', []),
+                                ('system.methodHelp', ['QueryData']),
+                                ('system.methodSignature', ['QueryData']),
+                                ('system.getCapabilities', [])]:
+            with self.client:
+                post_response = self.make_json_payload(method, arg_arr)
+                assert post_response.status_code == 200
+                assert getattr(g, 'query_count', 0) == 0, method
+
+    def test_multicall(self):
+        arg_arr = ['CBIBS', 'J', 'sea_water_temperature', '2015-10-01',
+                   '2015-10-02']
+        # QueryDataSimple has an optional since, passed in the last call
+        calls = [
+            ('ListPlatforms', ['CBIBS']),
+            ('QueryDataSimple', arg_arr),
+            ('NoSuchMethod', []),
+            ('system.listMethods', []),
+            ('QueryDataSimple', arg_arr + ['2015-10-01 12:00:00'])
+        ]
+        singles = [json.loads(self.make_json_payload(method, arg_arr).data)['result']
+                   for method, arg_arr in calls if method != 'NoSuchMethod']
+
+        multicall = [{'methodName': method, 'params': arg_arr}
+                     for method, arg_arr in calls]
+        post_response = self.make_json_payload('system.multicall', [multicall])
+        assert post_response.status_code == 200
+        result = json.loads(post_response.data)['result']
+        assert len(result) == 5
+        assert [result[0][0], result[1][0], result[3][0], result[4][0]] == singles
+        assert len(result[4][0]['time']) < len(result[1][0]['time'])
+        assert result[2]['faultCode'] == -32601
+
+        payload = xmlrpclib.dumps(([dict(call, methodName='xmlrpc_cdrh.' + call['methodName'])
+                                    for call in multicall[:2]], self.API_KEY),
+                                  'system.multicall')
+        post_response = self.client.post('/', data=payload, headers=XML_HEADERS)
+        assert post_response.status_code == 200
+        (result,), method = xmlrpclib.loads(post_response.data)
+        assert result[1][0] == singles[1]
+
+        post_response = self.make_json_payload('system.multicall', [multicall],
+                                               use_api_key=False)
+        assert post_response.status_code == 401
+
+    def test_json_batch(self):
+        arg_arr = ['CBIBS', 'J', 'sea_water_temperature']
+        batch = [{'method': 'LastMeasurementTime', 'params': arg_arr + [self.API_KEY], 'id': 1},
+                 {'method': 'system.getCapabilities', 'params': [], 'id': 2}]
+        post_response = self.client.post('/', data=json.dumps(batch), headers=JSON_HEADERS)
+        assert post_response.status_code == 200
+        result = json.loads(post_response.data)
+        assert [r['id'] for r in result] == [1, 2]
+        single = self.make_json_payload('LastMeasurementTime', arg_arr)
+        assert result[0]['result'] == json.loads(single.data)['result']
+        assert 'xmlrpc' in result[1]['result']
+
+        batch[0]['params'] = arg_arr + ['wrong key']
+        post_response = self.client.post('/', data=json.dumps(batch), headers=JSON_HEADERS)
+        assert post_response.status_code == 401
+
+    def test_request_body_limits(self):
+        max_bytes = app.config.get('MAX_RPC_BODY_BYTES')
+        app.config['MAX_RPC_BODY_BYTES'] = 64
+        try:
+            post_response = self.make_json_payload('ListPlatforms', ['CBIBS' * 20])
+            assert post_response.status_code == 413
+        finally:
+            app.config['MAX_RPC_BODY_BYTES'] = max_bytes
+
+        post_response = self.client.post('/', data='{"method": ', headers=JSON_HEADERS)
+        assert post_response.status_code == 400
+        post_response = self.client.post('/', data='<methodCall>', headers=XML_HEADERS)
+        assert post_response.status_code == 400
+
+    def test_repeated_payload(self):
+        """Memoized calls are not changed by the key check or dispatch"""
+        for i in range(3):
+            post_response = self.make_json_payload('ListPlatforms', ['CBIBS'])
+            assert post_response.status_code == 200
+            assert 'J' in json.loads(post_response.data)['result']['id']
+
+    def test_json_params(self):
+        for payload in [{'method': 'system.listMethods', 'id': 1, 'params': []},
+                        {'method': 'system.listMethods', 'id': 1}]:
+            post_response = self.client.post('/', data=json.dumps(payload),
+                                             headers=JSON_HEADERS)
+            assert post_response.status_code == 200
+            assert 'ListPlatforms' in json.loads(post_response.data)['result']
+
+        payload = {'method': 'system.listMethods', 'id': 1, 'params': {}}
+        post_response = self.client.post('/', data=json.dumps(payload),
+                                         headers=JSON_HEADERS)
+        assert post_response.status_code == 400
+
     def test_auth_vs_noauth(self):
         post_response = self.make_json_payload('system.listMethods', [], use_api_key=False)
         assert post_response.status_code == 200
@@ -0,0 +1,40 @@
+#!/usr/bin/env python
+'''
+tests/test_compression.py
+
+Unit tests for the compressed variants of cached responses
+'''
+
+from cbibs_api.compression import encode_variants, pack_variants, unpack_variants
+from cbibs_api.compression import brotli
+
+import gzip
+import unittest
+import zlib
+from StringIO import StringIO
+
+class TestVariants(unittest.TestCase):
+    def setUp(self):
+        self.body = '{"id": 1, "result": [%s], "error": null}' % ', '.join(
+            str(i * 0.25) for i in range(2000))
+
+    def test_variants_decode(self):
+        variants = encode_variants(self.body)
+        assert variants[''] == self.body
+        assert gzip.GzipFile(fileobj=StringIO(variants['gzip'])).read() == self.body
+        assert zlib.decompress(variants['deflate']) == self.body
+        if brotli:
+            assert brotli.decompress(variants['br']) == self.body
+        assert len(variants['gzip']) < len(self.body) / 2
+
+    def test_short_bodies_are_not_compressed(self):
+        assert encode_variants('{"id": 1}') == {'': '{"id": 1}'}
+
+    def test_pack(self):
+        variants = encode_variants(self.body)
+        assert unpack_variants(pack_variants(variants)) == variants
+        # entries cached before variants were stored
+        assert unpack_variants(self.body) == {'': self.body}
+
+if __name__ == '__main__':
+    unittest.main()
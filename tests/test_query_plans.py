@@ -0,0 +1,37 @@
+#!/usr/bin/env python
+'''
+tests/test_query_plans.py
+
+Checks that none of the stored queries sequentially scan the fact table.
+Requires the indexes in CreateObservationIndexes.sql.
+'''
+
+from cbibs_api.api import app
+from cbibs_api import db
+from cbibs_api.plans import check_plans, sequential_scans
+from flask.ext.testing import TestCase
+
+import unittest
+
+class TestQueryPlans(TestCase):
+    def create_app(self):
+        app.config['TESTING'] = True
+        return app
+
+    def test_sequential_scans(self):
+        plan = {
+            'Node Type': 'Nested Loop',
+            'Plans': [
+                {'Node Type': 'Seq Scan', 'Relation Name': 'd_station'},
+                {'Node Type': 'Seq Scan', 'Relation Name': 'f_observation'}
+            ]
+        }
+        assert len(sequential_scans(plan)) == 1
+
+    def test_no_fact_table_scans(self):
+        with db.engine.connect() as connection:
+            failures = check_plans(connection)
+        assert not failures, sorted(failures)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,72 @@
+#!/usr/bin/env python
+'''
+tests/test_serializers.py
+
+Unit tests for the JSON and XML-RPC response encoders
+'''
+
+from cbibs_api.serializers import create_serializer, format_times
+from cbibs_api.utils import xml_response
+from collections import OrderedDict
+from datetime import datetime
+from decimal import Decimal
+
+import json
+import unittest
+import numpy as np
+import pandas as pd
+import pytz
+import xmlrpclib
+
+class TestSerializers(unittest.TestCase):
+    def setUp(self):
+        self.times = pd.date_range('2015-10-01', periods=3, freq='6min')
+        self.values = np.array([1.5, 2.25, np.float64(1) / 3])
+
+    def test_identical_to_json(self):
+        dumps = create_serializer('json')
+        result = OrderedDict([('units', 'C'), ('value', self.values.tolist()),
+                              ('count', 3)])
+        assert dumps(result) == json.dumps(result)
+
+    def test_numpy_values(self):
+        dumps = create_serializer('json')
+        result = {'time': self.times.values, 'value': self.values,
+                  'count': np.int64(3), 'mean': Decimal('1.5')}
+        expected = {
+            'time': [t.strftime('%Y-%m-%d %H:%M:%S') for t in self.times],
+            'value': self.values.tolist(),
+            'count': 3,
+            'mean': 1.5
+        }
+        assert json.loads(dumps(result)) == expected
+
+    def test_format_times(self):
+        assert format_times(self.times.values) == ['2015-10-01 00:00:00',
+                                                   '2015-10-01 00:06:00',
+                                                   '2015-10-01 00:12:00']
+
+    def test_format_aware_datetimes(self):
+        eastern = pytz.timezone('US/Eastern')
+        times = [eastern.localize(datetime(2015, 10, 1, 8, 30, 5))]
+        assert format_times(times) == ['2015-10-01 12:30:05']
+        assert format_times([]) == []
+
+class TestXmlResponse(unittest.TestCase):
+    def test_identical_to_xmlrpclib(self):
+        results = [
+            {'time': ['2015-10-01 00:00:00', '2015-10-01 00:06:00'],
+             'value': [1.5, 1.0 / 3, float('nan')],
+             'units': 'C'},
+            {u'measurement': (u'sea_water_temperature', u'caf\xe9 & <b>'),
+             u'count': [1, 2, 3], u'mixed': [1, 2.5, 'x', True, [1], {'a': 'b'}],
+             u'empty': [], u'when': datetime(2015, 10, 1)},
+            ['a & b', '<c>'],
+            'a string',
+            42
+        ]
+        for result in results:
+            assert xml_response(result) == xmlrpclib.dumps((result,), methodresponse=True)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,52 @@
+#!/usr/bin/env python
+'''
+tests/test_statements.py
+
+Tests for the stored query statements and running them as prepared
+statements
+'''
+
+from cbibs_api.api import app
+from cbibs_api import db
+from cbibs_api.plans import SAMPLE_PARAMS, SKIP
+from cbibs_api.queries import SQL, Statement
+from flask.ext.testing import TestCase
+
+import unittest
+
+class TestStatements(TestCase):
+    def create_app(self):
+        app.config['TESTING'] = True
+        return app
+
+    def test_statement(self):
+        sql = Statement('SELECT a FROM t WHERE b = %(b)s AND c = ANY(%(c)s)\n'
+                        "  AND d LIKE 'x%%' AND e <> %(b)s;", 'Example')
+        assert sql.params == ('b', 'c')
+        assert sql.preparable
+        assert sql.prepare_sql == ("PREPARE cbibs_example AS SELECT a FROM t WHERE "
+                                   "b = $1 AND c = ANY($2)\n  AND d LIKE 'x%' AND e <> $1")
+        assert sql.execute_sql == 'EXECUTE cbibs_example(%(b)s, %(c)s)'
+        assert not SQL['CreateCurrentObservation'].preparable
+
+    def test_prepared_results(self):
+        """Every stored query returns the same rows prepared or not"""
+        prepared = app.config.get('PREPARED_STATEMENTS')
+        try:
+            for name, stored in SQL.iteritems():
+                if name.startswith(SKIP) or not stored.preparable:
+                    continue
+                app.config['PREPARED_STATEMENTS'] = False
+                expected = db.engine.execute(stored, SAMPLE_PARAMS).fetchall()
+                app.config['PREPARED_STATEMENTS'] = True
+                # prepared on first use, then reused
+                for i in range(2):
+                    with db.engine.connect() as connection:
+                        result = connection.execute(stored, SAMPLE_PARAMS)
+                        assert result.fetchall() == expected, name
+                        assert stored.name in connection.info['prepared']
+        finally:
+            app.config['PREPARED_STATEMENTS'] = prepared
+
+if __name__ == '__main__':
+    unittest.main()